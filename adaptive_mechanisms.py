@@ -1,10 +1,17 @@
+import copy
+import os
+import threading
 import time
-import torch
-import torch.nn as nn
-import torch.optim as optim
 import numpy as np
-import sqlite3
 import logging
+import sensor_store
+from replay_buffer import ReplayBuffer
+from numpy_policy import NumpyPolicy, policy_weights_path
+
+# torch is imported by the first DRLAgent, so processes that only act through NumpyPolicy never load it
+torch = None
+nn = None
+optim = None
 
 # Initialize logger
 logging.basicConfig(level=logging.DEBUG)
@@ -21,8 +28,20 @@ adaptive_responses = {
     'Battery': 'Replace or recharge battery'
 }
 
+# Checkpoint the shared DRL policy weights are loaded from
+checkpoint_path = 'drl_agent.pt'
+
+def _import_torch():
+    global torch, nn, optim
+    if torch is None:
+        import torch
+        import torch.nn as nn
+        import torch.optim as optim
+
 class DRLAgent:
-    def __init__(self, state_dim, action_dim):
+    def __init__(self, state_dim, action_dim, max_batch=1024, buffer_capacity=100000, batch_size=64,
+                 gamma=0.99, target_update_interval=500):
+        _import_torch()
         self.state_dim = state_dim
         self.action_dim = action_dim
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -38,48 +57,190 @@ class DRLAgent:
         
         self.optimizer = optim.Adam(self.model.parameters(), lr=0.001)
         self.criterion = nn.MSELoss()
+        
+        # Target network for the bootstrapped Q targets, synced every target_update_interval steps
+        self.gamma = gamma
+        self.target_update_interval = target_update_interval
+        self.target_model = copy.deepcopy(self.model)
+        self.target_model.requires_grad_(False)
+        self.train_steps = 0
+        
+        # Experience replay memory
+        self.memory = ReplayBuffer(buffer_capacity, state_dim, batch_size)
+        
+        # Preallocated input tensor for batched inference; grown on demand, guarded by a lock
+        # because the registry shares one agent between threads
+        self.input_buffer = torch.empty((max_batch, state_dim), dtype=torch.float32, device=self.device)
+        self.inference_lock = threading.Lock()
+        
+        # Acting policy: select_actions() reads this reference once per call, and publish_weights()
+        # loads new weights into a fresh copy off to the side and swaps the reference, so neither
+        # side takes a lock and an actor still running on the old module simply finishes with it
+        self.policy = self.model
+        self.policy_version = 0
+        
+        # Response time bookkeeping in nanoseconds
+        self.last_call_ns = 0
+        self.last_state_ns = 0
+        self.total_calls = 0
+        self.total_states = 0
+        self.total_ns = 0
     
-    def select_action(self, state):
-        start_time = time.time()  # Start timing
-        state = torch.FloatTensor(state).to(self.device)
-        q_values = self.model(state)
-        action = torch.argmax(q_values).item()
-        end_time = time.time()  # End timing
+    def select_actions(self, states):
+        """Select an action for every row of an (n, state_dim) batch with one forward pass.
+        
+        Returns (actions, response_time) where actions is an int array and response_time is the
+        wall time of the whole batch in seconds; the per-state time is kept in last_state_ns.
+        """
+        start_ns = time.perf_counter_ns()  # Start timing
+        states = np.asarray(states, dtype=np.float32).reshape(-1, self.state_dim)
+        n = len(states)
+        with self.inference_lock, torch.inference_mode():
+            if n > len(self.input_buffer):
+                self.input_buffer = torch.empty((max(n, 2 * len(self.input_buffer)), self.state_dim),
+                                                dtype=torch.float32, device=self.device)
+            batch = self.input_buffer[:n]
+            batch.copy_(torch.from_numpy(states))
+            q_values = self.policy(batch)
+            actions = torch.argmax(q_values, dim=1).cpu().numpy()
+        elapsed_ns = time.perf_counter_ns() - start_ns  # End timing
         
-        # Calculate response time
-        response_time = end_time - start_time
+        # Record per-call and per-state response times
+        self.last_call_ns = elapsed_ns
+        self.last_state_ns = elapsed_ns // max(n, 1)
+        self.total_calls += 1
+        self.total_states += n
+        self.total_ns += elapsed_ns
         
-        return action, response_time
+        return actions, elapsed_ns / 1e9
     
-    def train(self, state, action, reward, next_state, done):
-        state = torch.FloatTensor(state).to(self.device)
-        next_state = torch.FloatTensor(next_state).to(self.device)
-        action = torch.LongTensor([action]).to(self.device)
-        reward = torch.FloatTensor([reward]).to(self.device)
+    def select_action(self, state):
+        actions, response_time = self.select_actions(state)
+        return int(actions[0]), response_time
+    
+    def publish_weights(self, state_dict):
+        """Install new policy weights (tensors or arrays) with a single reference assignment."""
+        state_dict = {name: torch.as_tensor(value) for name, value in state_dict.items()}
+        policy = copy.deepcopy(self.policy).requires_grad_(False)
+        policy.load_state_dict(state_dict)
+        self.policy = policy
+        self.policy_version += 1
+    
+    def policy_weights(self):
+        """A copy of the acting policy's weights as a state_dict of NumPy arrays."""
+        state_dict = self.policy.state_dict()
+        return {name: value.detach().cpu().numpy().copy() for name, value in state_dict.items()}
+    
+    def load_weights(self, state_dict):
+        """Load weights (tensors or arrays) into the network, the acting policy and the target network."""
+        state_dict = {name: torch.as_tensor(value) for name, value in state_dict.items()}
+        self.model.load_state_dict(state_dict)
+        self.policy = self.model
+        self.sync_target()
+    
+    def export_weights(self, path=policy_weights_path):
+        """Write the acting policy to an .npz file that NumpyPolicy can load without torch."""
+        NumpyPolicy.from_weights(self.policy_weights()).save(path)
+    
+    def save_checkpoint(self, path=checkpoint_path):
+        torch.save(self.policy.state_dict(), path)
+    
+    def load_checkpoint(self, path=checkpoint_path):
+        self.load_weights(torch.load(path, map_location=self.device, weights_only=True))
+    
+    def sync_target(self):
+        self.target_model.load_state_dict(self.model.state_dict())
+    
+    def remember(self, state, action, reward, next_state, done):
+        """Store one transition, or a block of transitions, in the replay memory."""
+        self.memory.add(state, action, reward, next_state, done)
+    
+    def train_step(self):
+        """Run one minibatch update from the replay memory; returns the loss, or None while it is too small."""
+        if len(self.memory) < self.memory.batch_size:
+            return None
+        states, actions, rewards, next_states, dones = (
+            torch.from_numpy(array).to(self.device) for array in self.memory.sample())
         
-        # Compute Q-values
-        q_values = self.model(state)
-        next_q_values = self.model(next_state)
-        next_q_value = torch.max(next_q_values)
+        # Compute Q-values of the taken actions
+        q_values = self.model(states).gather(1, actions.unsqueeze(1)).squeeze(1)
         
-        # Compute expected Q-value
-        expected_q_value = reward + 0.99 * next_q_value * (1 - done)
+        # Compute expected Q-values from the target network
+        with torch.no_grad():
+            next_q_values = self.target_model(next_states).max(dim=1).values
+            expected_q_values = rewards + self.gamma * next_q_values * (1 - dones)
         
         # Compute loss
-        loss = self.criterion(q_values.gather(1, action.unsqueeze(1)), expected_q_value.detach())
+        loss = self.criterion(q_values, expected_q_values)
         
         # Optimize the model
         self.optimizer.zero_grad()
         loss.backward()
         self.optimizer.step()
+        
+        self.train_steps += 1
+        if self.train_steps % self.target_update_interval == 0:
+            self.sync_target()
+        return loss.item()
+    
+    def train(self, state, action, reward, next_state, done):
+        # Store the transition and learn from a replayed minibatch; an agent whose policy is fed by
+        # a BackgroundLearner should not also be trained in place
+        self.remember(state, action, reward, next_state, done)
+        return self.train_step()
+
+# Process-wide registry so every module shares one agent per configuration
+_agents = {}
+_agents_lock = threading.Lock()
+
+def get_agent(state_dim=len(adaptive_responses), action_dim=len(adaptive_responses), checkpoint=checkpoint_path):
+    """Return the shared DRLAgent, creating it and loading the checkpoint (if present) on first use."""
+    key = (state_dim, action_dim, checkpoint)
+    with _agents_lock:
+        agent = _agents.get(key)
+        if agent is None:
+            agent = DRLAgent(state_dim, action_dim)
+            if checkpoint and os.path.exists(checkpoint):
+                try:
+                    agent.load_checkpoint(checkpoint)
+                    logging.info(f"Loaded DRL agent weights from {checkpoint}.")
+                except Exception as e:
+                    logging.error(f"Error loading DRL agent checkpoint {checkpoint}: {e}")
+            _agents[key] = agent
+        return agent
+
+# Process-wide registry of the torch-free acting policies
+_policies = {}
+_policies_lock = threading.Lock()
+
+def _load_policy(state_dim, action_dim, weights, checkpoint):
+    # Prefer exported NumPy weights, then a torch checkpoint, then a fresh untrained policy
+    if weights and os.path.exists(weights):
+        try:
+            policy = NumpyPolicy.load(weights)
+            if (policy.state_dim, policy.action_dim) == (state_dim, action_dim):
+                logging.info(f"Loaded DRL policy weights from {weights}.")
+                return policy
+            logging.warning(f"Ignoring DRL policy weights {weights} with shape {policy.state_dim}->{policy.action_dim}.")
+        except Exception as e:
+            logging.error(f"Error loading DRL policy weights {weights}: {e}")
+    if checkpoint and os.path.exists(checkpoint):
+        return NumpyPolicy.from_weights(get_agent(state_dim, action_dim, checkpoint).policy_weights())
+    return NumpyPolicy.random(state_dim, action_dim)
+
+def get_policy(state_dim=len(adaptive_responses), action_dim=len(adaptive_responses),
+               weights=policy_weights_path, checkpoint=checkpoint_path):
+    """Return the shared NumpyPolicy used for acting; torch is only imported to convert a checkpoint."""
+    key = (state_dim, action_dim, weights, checkpoint)
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = _policies[key] = _load_policy(state_dim, action_dim, weights, checkpoint)
+        return policy
 
 def fetch_latest_sensor_values():
     try:
-        conn = sqlite3.connect('racing_vehicle_db.sqlite')
-        cursor = conn.cursor()
-        cursor.execute("SELECT sensor, value FROM sensor_data ORDER BY timestamp DESC LIMIT 8")  # Fetch latest 8 sensors
-        data = cursor.fetchall()
-        conn.close()
+        data = sensor_store.fetch_latest_rows(8)  # Fetch latest 8 sensors
         
         # Convert to dict and ensure it matches the expected sensor order
         sensor_values = {sensor: None for sensor in adaptive_responses.keys()}
@@ -95,10 +256,10 @@ def fetch_latest_sensor_values():
 
 def apply_adaptive_response(sensor_values):
     try:
-        # Initialize DRL agent
+        # Get the shared DRL policy
         state_dim = len(sensor_values)
         action_dim = len(adaptive_responses)
-        agent = DRLAgent(state_dim, action_dim)
+        agent = get_policy(state_dim, action_dim)
         
         # Convert sensor values to state
         state = np.array(sensor_values).astype(float)
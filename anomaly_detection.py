@@ -1,9 +1,14 @@
 import numpy as np
-import sqlite3
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
+import hashlib
+import os
+import pickle
 import logging
 import datetime
+import time
+from detector_engines import AnomalyDetector, EWMAControlChart
+import sensor_store
+import sensor_archive
+from forest_scorer import FlatIsolationForest
 
 # Initialize logger
 logging.basicConfig(level=logging.DEBUG)
@@ -12,29 +17,43 @@ logging.basicConfig(level=logging.DEBUG)
 sensors = ['Temperature', 'Speed', 'Engine Sensors', 'Brakes', 'Fluid Level', 'Heat', 'Tire Pressure', 'Battery']
 num_sensors = len(sensors)
 
-# Placeholder for StandardScaler and IsolationForest
-scaler = StandardScaler()
-model_if = None
+# Per-sensor (StandardScaler, IsolationForest) pairs keyed by sensor name
+sensor_models = {}
+
+# Per-sensor (scaler mean, scaler scale, FlatIsolationForest) used by the flat scoring backend, loaded
+# from the flat model cache or exported from sensor_models when they are installed, so that detection
+# never has to import sklearn or export a forest
+flat_sensor_models = {}
+
+# Training window per sensor, minimum history needed to fit a sensor, and the on-disk model cache
+history_limit = 1000
+min_history = 10
+model_params = {'contamination': 0.05, 'random_state': 42}
+model_cache_path = 'anomaly_models.pkl'
+flat_model_cache_path = 'anomaly_models.npz'
+
+# The caches are keyed on how the models are fitted and on the sensor_data snapshot they were fitted
+# on: bump the version when fitting changes in a way model_params does not show. Cached models are
+# refitted on startup once they are older than model_max_age seconds (None keeps them), once a full
+# training window of rows has arrived since the snapshot, or when the database no longer reaches the
+# snapshot (swapped, restored or truncated); drift in between is handled by model_refitter.BackgroundRefitter.
+model_cache_version = 2
+model_max_age = 24 * 3600
+
+# Optional model_refitter.BackgroundRefitter that is fed the IsolationForest scores
+refitter = None
 
 def fetch_historical_data():
     try:
-        conn = sqlite3.connect('racing_vehicle_db.sqlite')
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM sensor_data ORDER BY timestamp DESC LIMIT 1000")
-        data = cursor.fetchall()
-        conn.close()
-        return np.array([row[0] for row in data])  # Convert to NumPy array
+        data = sensor_store.fetch_recent_values(1000)
+        return np.array(data)  # Convert to NumPy array
     except Exception as e:
         logging.error(f"Error fetching historical data from database: {e}")
         return []
 
 def fetch_latest_sensor_values():
     try:
-        conn = sqlite3.connect('racing_vehicle_db.sqlite')
-        cursor = conn.cursor()
-        cursor.execute("SELECT sensor, value FROM sensor_data ORDER BY timestamp DESC LIMIT ?", (num_sensors,))
-        data = cursor.fetchall()
-        conn.close()
+        data = sensor_store.fetch_latest_rows(num_sensors)
         
         # Convert to dict and ensure it matches the expected sensor order
         sensor_values = {sensor: None for sensor in sensors}
@@ -48,27 +67,188 @@ def fetch_latest_sensor_values():
         logging.error(f"Error fetching latest sensor values from database: {e}")
         return [None] * num_sensors
 
-def fit_model():
-    global scaler, model_if
+def fetch_sensor_history(sensor, limit=history_limit):
+    """Fetch the latest `limit` values of one sensor, newest first, continuing into sensor_archive when the database has too few."""
+    try:
+        data = sensor_store.fetch_sensor_history(sensor, limit)
+        values = np.array([value for value in data if value is not None], dtype=float)
+        if len(values) < limit:
+            values = np.concatenate([values, sensor_archive.sensor_history(sensor, limit - len(values))])
+        return values
+    except Exception as e:
+        logging.error(f"Error fetching historical data for {sensor} from database: {e}")
+        return np.array([], dtype=float)
+
+def model_fingerprint():
+    """Fingerprint the fitting configuration: cache version, model parameters, training window and sensors."""
+    config = (model_cache_version, sorted(model_params.items()), history_limit, min_history, sensors)
+    return hashlib.sha256(repr(config).encode()).hexdigest()
+
+def snapshot_meta(snapshot_rowid):
+    """Cache metadata for models fitted now on the sensor_data rows up to `snapshot_rowid`."""
+    return {'fingerprint': model_fingerprint(), 'fitted_at': time.time(), 'snapshot_rowid': snapshot_rowid}
+
+def cache_is_current(meta):
+    """A cache is reused while it was fitted with the current configuration, on a snapshot of this database
+    that fewer than a training window of rows have been added to since, and is younger than model_max_age."""
+    if not meta or meta.get('fingerprint') != model_fingerprint():
+        return False
+    if model_max_age is not None and time.time() - meta.get('fitted_at', 0) >= model_max_age:
+        return False
+    snapshot_rowid = meta.get('snapshot_rowid') or 0
+    current_rowid = sensor_store.fetch_max_sensor_rowid() or 0
+    if current_rowid < snapshot_rowid:
+        logging.info("sensor_data no longer reaches the cached models' snapshot; refitting.")
+        return False
+    return current_rowid - snapshot_rowid <= history_limit * num_sensors
+
+def load_model_cache(path=model_cache_path):
+    """Return (metadata, models) from the cache file, or (None, {}) if it is missing or unreadable."""
+    if not os.path.exists(path):
+        return None, {}
+    try:
+        with open(path, 'rb') as f:
+            cache = pickle.load(f)
+        return cache.get('meta'), cache['models']
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable anomaly model cache {path}: {e}")
+        return None, {}
+
+def save_model_cache(meta, models, path=model_cache_path):
+    # Write to a temporary file first so a concurrent reader never sees a partial cache
+    try:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'meta': meta, 'models': models}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Error saving anomaly model cache: {e}")
+
+def load_flat_model_cache(path=flat_model_cache_path):
+    """Return (metadata, {sensor: (mean, scale, FlatIsolationForest)}), or (None, {}) if unavailable."""
+    if not os.path.exists(path):
+        return None, {}
+    try:
+        with np.load(path) as arrays:
+            arrays = dict(arrays)
+        models = {}
+        for i, sensor in enumerate(sensors):
+            prefix = f'{i}_'
+            if prefix + 'scaler_mean' in arrays:
+                models[sensor] = (float(arrays[prefix + 'scaler_mean']), float(arrays[prefix + 'scaler_scale']),
+                                  FlatIsolationForest.from_arrays(arrays, prefix))
+        meta = {'fingerprint': str(arrays['fingerprint']), 'fitted_at': float(arrays['fitted_at']),
+                'snapshot_rowid': int(arrays['snapshot_rowid'])}
+        return meta, models
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable flat anomaly model cache {path}: {e}")
+        return None, {}
+
+def save_flat_model_cache(meta, flat_models, path=flat_model_cache_path):
+    # Store every exported (mean, scale, forest) triple as plain arrays; written atomically like the pickle cache
+    try:
+        arrays = {'fingerprint': np.array(meta['fingerprint']), 'fitted_at': np.array(meta['fitted_at']),
+                  'snapshot_rowid': np.array(meta['snapshot_rowid'] or 0)}
+        for i, sensor in enumerate(sensors):
+            if sensor not in flat_models:
+                continue
+            mean, scale, forest = flat_models[sensor]
+            prefix = f'{i}_'
+            arrays[prefix + 'scaler_mean'] = np.array(mean)
+            arrays[prefix + 'scaler_scale'] = np.array(scale)
+            for name, array in forest.arrays().items():
+                arrays[prefix + name] = array
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.error(f"Error saving flat anomaly model cache: {e}")
+
+def fit_sensor_model(values):
+    """Fit one (StandardScaler, IsolationForest) pair on a 1-D array of readings."""
+    # sklearn is only imported when a model actually has to be fitted
+    from sklearn.ensemble import IsolationForest
+    from sklearn.preprocessing import StandardScaler
+    
+    scaler = StandardScaler()
+    scaled_values = scaler.fit_transform(values.reshape(-1, 1))
+    model = IsolationForest(**model_params)
+    model.fit(scaled_values)
+    return scaler, model
+
+def export_flat_models(models, sensors_to_export=None, flat_models=None):
+    """Export (scaler, IsolationForest) pairs to {sensor: (mean, scale, FlatIsolationForest)}.
+
+    Only `sensors_to_export` (default: all) are exported; the other entries are taken from `flat_models`.
+    """
+    exported = dict(flat_models or {})
+    for sensor in sensors_to_export if sensors_to_export is not None else models:
+        scaler, model = models[sensor]
+        exported[sensor] = (float(scaler.mean_[0]), float(scaler.scale_[0]), FlatIsolationForest.from_sklearn(model))
+    return exported
+
+def install_sensor_models(models, flat_models=None):
+    """Swap in a complete set of per-sensor models, and optionally their flat exports, with reference assignments."""
+    global sensor_models
+    sensor_models = models
+    if flat_models is not None:
+        install_flat_sensor_models(flat_models)
+
+def install_flat_sensor_models(models):
+    """Swap in a complete set of flat per-sensor models with a single reference assignment."""
+    global flat_sensor_models
+    flat_sensor_models = models
+
+def fit_model(force=False, flat=False):
+    """Load the per-sensor models from the cache while it is current (see cache_is_current), fitting them otherwise.
     
+    The cache survives the rows a short run inserts, but not a whole new training window of them.
+    With flat=True the flat model cache is tried first, and refreshed whenever the
+    sklearn models had to be loaded or fitted, so later runs of the flat backend start without sklearn.
+    """
     try:
-        # Fetch historical data from database
-        historical_values = fetch_historical_data()
+        if flat and not force:
+            meta, cached_flat_models = load_flat_model_cache()
+            if cached_flat_models and cache_is_current(meta):
+                install_flat_sensor_models(cached_flat_models)
+                logging.info("Loaded flat per-sensor anomaly models from cache.")
+                return True
         
-        if not historical_values.size:
+        meta, cached_models = load_model_cache()
+        if not force and cached_models and cache_is_current(meta):
+            flat_models = export_flat_models(cached_models) if flat else None
+            install_sensor_models(cached_models, flat_models)
+            if flat:
+                save_flat_model_cache(meta, flat_models)
+            logging.info("Loaded per-sensor anomaly models from cache.")
+            return True
+        
+        # Fit on a snapshot: the latest history_limit values per sensor, up to the current last row
+        snapshot_rowid = sensor_store.fetch_max_sensor_rowid()
+        histories = {sensor: fetch_sensor_history(sensor) for sensor in sensors}
+        
+        if not any(len(values) for values in histories.values()):
             logging.warning("No historical data fetched from the database")
             return False
         
-        # Scale the historical data
-        scaled_values = scaler.fit_transform(historical_values.reshape(-1, 1))
-        
-        # Initialize Isolation Forest model
-        model_if = IsolationForest(contamination=0.05, random_state=42)
+        models = {}
+        for sensor in sensors:
+            if len(histories[sensor]) >= min_history:
+                models[sensor] = fit_sensor_model(histories[sensor])
+            else:
+                logging.warning(f"Not enough history to fit an anomaly model for {sensor}")
         
-        # Fit the Isolation Forest model with scaled historical data
-        model_if.fit(scaled_values)
+        if not models:
+            return False
         
-        logging.info("StandardScaler and IsolationForest fitted successfully.")
+        meta = snapshot_meta(snapshot_rowid)
+        flat_models = export_flat_models(models) if flat else None
+        install_sensor_models(models, flat_models)
+        save_model_cache(meta, models)
+        if flat:
+            save_flat_model_cache(meta, flat_models)
+        logging.info("Per-sensor StandardScaler and IsolationForest models fitted successfully.")
         return True
         
     except Exception as e:
@@ -77,64 +257,125 @@ def fit_model():
 
 def save_anomalies_to_db(anomaly_data):
     try:
-        conn = sqlite3.connect('racing_vehicle_db.sqlite')
-        cursor = conn.cursor()
-        
-        # Insert anomalies into the database
-        for timestamp, sensor, value, detection_time in anomaly_data:
-            cursor.execute("""
-                INSERT INTO anomalies (timestamp, sensor, value, detection_time)
-                VALUES (?, ?, ?, ?)
-            """, (timestamp, sensor, value, detection_time))
-        
-        conn.commit()
-        conn.close()
+        # Insert anomalies into the database over the pooled connection
+        sensor_store.insert_anomalies(anomaly_data)
         logging.info("Anomalies saved to database successfully.")
         
     except Exception as e:
         logging.error(f"Error saving anomalies to database: {e}")
 
-def detect_anomalies(sensor_values):
-    try:
-        global model_if
-        
-        # Ensure the model is fitted
-        if not model_if:
-            fit_success = fit_model()
-            if not fit_success:
-                return {sensor: False for sensor in sensors}, {sensor: None for sensor in sensors}
-        
-        anomaly_flags = {}
-        anomaly_values = {}
-        anomaly_data = []
-        
-        # Get current timestamp
-        current_timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Scale each sensor value individually
-        for i, sensor_value in enumerate(sensor_values):
-            if sensor_value is not None:
-                scaled_value = scaler.transform(np.array(sensor_value).reshape(1, -1))
-                anomaly_score = model_if.decision_function(scaled_value)  # Use decision_function for anomaly score
-                is_anomaly = anomaly_score[0] < 0
-                anomaly_flags[sensors[i]] = is_anomaly
-                anomaly_values[sensors[i]] = sensor_value if is_anomaly else None
-                
-                if is_anomaly:
-                    anomaly_data.append((current_timestamp, sensors[i], sensor_value, current_timestamp))
+class IsolationForestEngine(AnomalyDetector):
+    """Batch engine backed by the per-sensor IsolationForest models in sensor_models.
+    
+    backend='sklearn' scores with the fitted estimators; backend='flat' scores with the
+    FlatIsolationForest exports in flat_sensor_models using NumPy array operations, which gives the
+    same decision_function values without sklearn's per-call validation and per-estimator dispatch.
+    The exports come from the flat model cache or are made by whoever installs the models (fit_model
+    or the background refitter), never on the detection path, so the flat backend runs without
+    sklearn until a model has to be (re)fitted.
+    """
+    
+    name = 'isolation_forest'
+    backends = ('sklearn', 'flat')
+    
+    def __init__(self, backend='sklearn'):
+        if backend not in self.backends:
+            raise ValueError(f"Unknown scoring backend '{backend}', expected one of {self.backends}")
+        self.backend = backend
+    
+    def ready(self):
+        # Ensure the models are fitted
+        if self.backend == 'flat':
+            return bool(flat_sensor_models) or fit_model(flat=True)
+        return bool(sensor_models) or fit_model()
+    
+    def score(self, values):
+        scores = np.full(values.shape, np.nan)
+        
+        # Score every available reading of a sensor at once with that sensor's own model
+        models = sensor_models
+        flat_models = flat_sensor_models
+        for i, sensor in enumerate(sensors):
+            valid = ~np.isnan(values[:, i])
+            if not valid.any():
+                continue
+            if self.backend == 'flat':
+                if sensor not in flat_models:
+                    continue
+                mean, scale, forest = flat_models[sensor]
+                scaled_values = (values[valid, i] - mean) / scale
+                scores[valid, i] = forest.decision_function(scaled_values.reshape(-1, 1))
             else:
-                anomaly_flags[sensors[i]] = False
-                anomaly_values[sensors[i]] = None
+                if sensor not in models:
+                    continue
+                scaler, model = models[sensor]
+                scaled_values = scaler.transform(values[valid, i].reshape(-1, 1))
+                scores[valid, i] = model.decision_function(scaled_values)  # Use decision_function for anomaly score
+        return scores
+
+# Available detection engines and the one detect_anomalies_batch currently uses
+detector_engines = {
+    IsolationForestEngine.name: lambda **kwargs: IsolationForestEngine(**kwargs),
+    EWMAControlChart.name: lambda **kwargs: EWMAControlChart(num_sensors, **kwargs),
+}
+detector = IsolationForestEngine()
+
+def set_detector_engine(name, **kwargs):
+    """Select the detection engine by name ('isolation_forest' or 'ewma'); kwargs go to its constructor."""
+    global detector
+    if name not in detector_engines:
+        raise ValueError(f"Unknown detector engine '{name}', expected one of {sorted(detector_engines)}")
+    detector = detector_engines[name](**kwargs)
+    logging.info(f"Anomaly detection engine set to {name}.")
+    return detector
+
+def detect_anomalies_batch(sensor_values, save=True):
+    """Score an (n_rows, num_sensors) array of readings with the active detection engine.
+    
+    Rows may be ticks, vehicles or both. Returns a boolean flag array and a float array holding
+    the anomalous values (NaN elsewhere), both shaped like the input. Missing readings (None/NaN)
+    are never flagged.
+    """
+    values = np.array(sensor_values, dtype=float).reshape(-1, num_sensors)
+    anomaly_flags = np.zeros(values.shape, dtype=bool)
+    anomaly_values = np.full(values.shape, np.nan)
+    
+    try:
+        engine = detector
+        if not engine.ready():
+            return anomaly_flags, anomaly_values
+        
+        anomaly_scores = engine.score(values)
+        engine.update(values)
         
-        # Save anomalies to the database
-        if anomaly_data:
+        # Feed the background refitter, which watches the score distribution for drift
+        if refitter is not None and isinstance(engine, IsolationForestEngine):
+            refitter.observe(anomaly_scores)
+        
+        # Negative scores are anomalies; unscored (NaN) readings never are
+        anomaly_flags = np.nan_to_num(anomaly_scores, nan=0.0) < 0
+        anomaly_values[anomaly_flags] = values[anomaly_flags]
+        
+        # Save anomalies to the database unless the caller persists them itself
+        if save and anomaly_flags.any():
+            current_timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            rows, cols = np.nonzero(anomaly_flags)
+            anomaly_data = [(current_timestamp, sensors[c], float(values[r, c]), current_timestamp)
+                            for r, c in zip(rows, cols)]
             save_anomalies_to_db(anomaly_data)
         
         return anomaly_flags, anomaly_values
     
     except Exception as e:
         logging.error(f"Error in anomaly detection: {e}")
-        return {sensor: False for sensor in sensors}, {sensor: None for sensor in sensors}
+        return np.zeros(values.shape, dtype=bool), np.full(values.shape, np.nan)
+
+def detect_anomalies(sensor_values, save=True):
+    """Detect anomalies in one reading per sensor; returns ({sensor: flag}, {sensor: value or None})."""
+    flags, values = detect_anomalies_batch([sensor_values], save=save)
+    anomaly_flags = {sensor: bool(flags[0, i]) for i, sensor in enumerate(sensors)}
+    anomaly_values = {sensor: float(values[0, i]) if flags[0, i] else None for i, sensor in enumerate(sensors)}
+    return anomaly_flags, anomaly_values
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,126 @@
+import numpy as np
+
+class RollingSensorStats:
+    """Per-sensor running mean, variance and EWMA over a fixed-size preallocated ring buffer."""
+
+    def __init__(self, num_sensors, window=1000, alpha=0.1):
+        self.num_sensors = num_sensors
+        self.window = window
+        self.alpha = alpha
+
+        # Preallocated ring buffer holding the last `window` rows
+        self.buffer = np.zeros((window, num_sensors))
+        self.index = 0
+        self.count = 0
+        self.updates_since_resync = 0
+
+        # Running sums over the rows currently held in the buffer
+        self.sum = np.zeros(num_sensors)
+        self.sum_sq = np.zeros(num_sensors)
+
+        # Exponentially weighted moving average of the per-update mean
+        self.ewma_values = np.zeros(num_sensors)
+        self.ewma_ready = False
+
+    def update(self, values):
+        """Add one row or an (n_rows, num_sensors) block of rows in O(n_rows)."""
+        values = np.asarray(values, dtype=float).reshape(-1, self.num_sensors)
+        if not len(values):
+            return
+
+        # EWMA is updated once per call with the mean of the incoming rows
+        batch_mean = values.mean(axis=0)
+        if self.ewma_ready:
+            self.ewma_values = self.alpha * batch_mean + (1 - self.alpha) * self.ewma_values
+        else:
+            self.ewma_values = batch_mean
+            self.ewma_ready = True
+
+        # Only the newest `window` rows can survive in the buffer
+        values = values[-self.window:]
+        n = len(values)
+        positions = (self.index + np.arange(n)) % self.window
+
+        # Remove the rows that are about to be overwritten from the running sums; free slots
+        # are always filled first, so the occupied ones are the last `evicted` positions
+        evicted = max(0, self.count + n - self.window)
+        if evicted:
+            old = self.buffer[positions[n - evicted:]]
+            self.sum -= old.sum(axis=0)
+            self.sum_sq -= np.square(old).sum(axis=0)
+
+        self.buffer[positions] = values
+        self.sum += values.sum(axis=0)
+        self.sum_sq += np.square(values).sum(axis=0)
+        self.index = (self.index + n) % self.window
+        self.count = min(self.count + n, self.window)
+
+        # Recompute the sums from the buffer once per window to stop floating-point drift
+        self.updates_since_resync += n
+        if self.updates_since_resync >= self.window:
+            self.resync()
+
+    def resync(self):
+        """Recompute the running sums from the buffer contents."""
+        filled = self.buffer[:self.count] if self.count < self.window else self.buffer
+        self.sum = filled.sum(axis=0)
+        self.sum_sq = np.square(filled).sum(axis=0)
+        self.updates_since_resync = 0
+
+    def mean(self):
+        """Mean of every sensor over the window, 0 while no data has been seen."""
+        if not self.count:
+            return np.zeros(self.num_sensors)
+        return self.sum / self.count
+
+    def variance(self):
+        """Population variance of every sensor over the window."""
+        if not self.count:
+            return np.zeros(self.num_sensors)
+        mean = self.sum / self.count
+        return np.maximum(self.sum_sq / self.count - np.square(mean), 0.0)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def ewma(self):
+        return self.ewma_values.copy()
+
+    def values(self):
+        """Rows currently held in the window, oldest first."""
+        if self.count < self.window:
+            return self.buffer[:self.count].copy()
+        return np.roll(self.buffer, -self.index, axis=0)
+
+class RunningMeanImputer:
+    """NaN-aware mean imputer whose column means are updated incrementally."""
+
+    def __init__(self, num_features, fill_value=0.0):
+        self.num_features = num_features
+        self.fill_value = fill_value  # Used for columns that have not seen a valid value yet
+        self.sum = np.zeros(num_features)
+        self.count = np.zeros(num_features, dtype=np.int64)
+
+    def partial_fit(self, X):
+        """Fold one row or an (n_rows, num_features) block into the running column means."""
+        X = np.asarray(X, dtype=float).reshape(-1, self.num_features)
+        valid = ~np.isnan(X)
+        self.sum += np.where(valid, X, 0.0).sum(axis=0)
+        self.count += valid.sum(axis=0)
+        return self
+
+    def means(self):
+        means = np.full(self.num_features, self.fill_value, dtype=float)
+        np.divide(self.sum, self.count, out=means, where=self.count > 0)
+        return means
+
+    def transform(self, X):
+        """Replace NaN entries with the current column means; O(size of X)."""
+        X = np.array(X, dtype=float).reshape(-1, self.num_features)
+        missing = np.isnan(X)
+        if missing.any():
+            X[missing] = np.broadcast_to(self.means(), X.shape)[missing]
+        return X
+
+    def fit_transform(self, X):
+        return self.partial_fit(X).transform(X)
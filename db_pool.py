@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Pragmas applied to every pooled connection
+PRAGMAS = {
+    'journal_mode': 'WAL',          # Readers never block the writer and vice versa
+    'synchronous': 'NORMAL',        # fsync at checkpoints only; safe with WAL
+    'mmap_size': 268435456,         # Read pages through a 256 MB memory map
+    'cache_size': -65536,           # 64 MB page cache per connection
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,           # Wait up to 5 s for a competing writer instead of failing
+}
+
+# Number of prepared statements each connection keeps compiled, keyed by SQL text
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+_all_connections = []
+_all_lock = threading.Lock()
+
+# Bumped by close_all() so every thread drops its closed connections on next use
+_generation = 0
+
+def _open(db_path):
+    # check_same_thread=False only so close_all() can close connections at shutdown;
+    # each connection is still used exclusively by the thread that opened it
+    conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+    for name, value in PRAGMAS.items():
+        conn.execute(f'PRAGMA {name}={value}')
+    with _all_lock:
+        _all_connections.append(conn)
+    return conn
+
+def get_connection(db_path):
+    """Return this thread's long-lived connection to `db_path`, opening it on first use."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.generation != _generation:
+        connections = _local.connections = {}
+        _local.generation = _generation
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = _open(db_path)
+    return conn
+
+def close_connection(db_path):
+    """Close this thread's connection to `db_path`, if any."""
+    connections = getattr(_local, 'connections', {})
+    conn = connections.pop(db_path, None)
+    if conn is not None:
+        with _all_lock:
+            if conn in _all_connections:
+                _all_connections.remove(conn)
+        conn.close()
+
+def close_all():
+    """Close every pooled connection of every thread; call at shutdown."""
+    global _generation
+    with _all_lock:
+        _generation += 1
+        connections = list(_all_connections)
+        _all_connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logging.error(f"Error closing pooled connection: {e}")
+
+def checkpoint(db_path):
+    """Fold the WAL back into the main database file, e.g. before copying it for a backup."""
+    try:
+        get_connection(db_path).execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    except sqlite3.Error as e:
+        logging.error(f"Error checkpointing {db_path}: {e}")
@@ -0,0 +1,119 @@
+import threading
+import numpy as np
+
+class AnomalyDetector:
+    """Interface shared by the anomaly detection engines.
+
+    score() takes an (n_rows, n_sensors) array and returns scores of the same shape where
+    negative means anomalous (the sign convention of IsolationForest.decision_function) and
+    NaN means "not scored". update() folds the rows into the engine's state.
+    """
+
+    name = None
+
+    def ready(self):
+        """Return True once the engine can score; may fit or load models on first use."""
+        return True
+
+    def score(self, values):
+        raise NotImplementedError
+
+    def update(self, values):
+        pass
+
+class EWMAControlChart(AnomalyDetector):
+    """Streaming per-sensor control chart with a robust EWMA centre line and EWMA absolute deviation.
+
+    Each reading is scored as threshold - |x - mean| / sigma, where sigma is estimated from the
+    exponentially weighted mean absolute deviation. The first `warmup` readings of a sensor are
+    only buffered; the chart is then seeded with their median and MAD, so failures (-999) and
+    spikes among them cannot skew the seed. From then on every reading is clipped to `clip` sigmas
+    around the centre line before it updates the chart, which keeps attacks (spikes, stuck -999
+    failures) from dragging the centre line or inflating sigma. The EWMAs are bias-corrected for
+    the weight they have accumulated, so they track the data at the rate of a plain average right
+    after the seed and at `alpha` in steady state. Updates are O(1) per sample and the state is a
+    few arrays of length n_sensors plus the warmup buffer, so memory does not grow with the session.
+    """
+
+    name = 'ewma'
+
+    # Ratio between the standard deviation and the mean absolute deviation of a normal distribution
+    MAD_TO_SIGMA = 1.2533
+    # Ratio between the mean absolute deviation and the median absolute deviation of a normal distribution
+    MEDIAN_TO_MEAN_ABS_DEV = 1.1829
+
+    def __init__(self, num_sensors, alpha=0.01, threshold=4.0, warmup=30, min_sigma=1e-6, clip=2.0):
+        self.num_sensors = num_sensors
+        self.alpha = alpha
+        self.threshold = threshold
+        self.clip = clip
+        self.warmup = warmup
+        self.min_sigma = min_sigma
+        self.mean = np.zeros(num_sensors)
+        self.abs_dev = np.zeros(num_sensors)
+        self.weight = np.zeros(num_sensors)  # EWMA weight accumulated so far, 1 - (1 - alpha) ** samples
+        self.count = np.zeros(num_sensors, dtype=np.int64)
+        self.warmup_values = np.full((warmup, num_sensors), np.nan)
+        self.lock = threading.Lock()  # update() is a read-modify-write of the whole state
+
+    def sigma(self):
+        return np.maximum(self.abs_dev * self.MAD_TO_SIGMA, self.min_sigma)
+
+    def score(self, values):
+        values = np.asarray(values, dtype=float).reshape(-1, self.num_sensors)
+        scores = self.threshold - np.abs(values - self.mean) / self.sigma()
+
+        # Sensors still warming up are never flagged
+        scores[:, self.count < self.warmup] = self.threshold
+        scores[np.isnan(values)] = np.nan
+        return scores
+
+    def update(self, values):
+        """Fold a block of rows into the chart; a block of n rows decays the state like n single updates."""
+        values = np.asarray(values, dtype=float).reshape(-1, self.num_sensors)
+        with self.lock:
+            values = self._fill_warmup(values)
+            self._update(values)
+
+    def _fill_warmup(self, values):
+        # Buffer readings of sensors still warming up and seed the sensors whose buffer fills;
+        # returns the readings that are left for the EWMA update (buffered ones become NaN)
+        warming = np.flatnonzero(self.count < self.warmup)
+        if not len(warming):
+            return values
+        values = values.copy()
+        for sensor in warming:
+            column = values[:, sensor]
+            rows = np.flatnonzero(~np.isnan(column))[:self.warmup - self.count[sensor]]
+            self.warmup_values[self.count[sensor]:self.count[sensor] + len(rows), sensor] = column[rows]
+            self.count[sensor] += len(rows)
+            column[rows] = np.nan
+            if self.count[sensor] == self.warmup:
+                seed = self.warmup_values[:, sensor]
+                self.mean[sensor] = np.median(seed)
+                self.abs_dev[sensor] = np.median(np.abs(seed - self.mean[sensor])) * self.MEDIAN_TO_MEAN_ABS_DEV
+                self.weight[sensor] = 1.0 - (1.0 - self.alpha) ** self.warmup
+        return values
+
+    def _update(self, values):
+        valid = ~np.isnan(values)
+        n = valid.sum(axis=0)
+        if not n.any():
+            return
+
+        # Clip readings to clip sigmas (Huber-style) so outliers move the state no more than an ordinary reading
+        limit = self.clip * self.sigma()
+        clipped = np.where(valid, np.clip(values, self.mean - limit, self.mean + limit), 0.0)
+
+        has_data = n > 0
+        batch_mean = np.divide(clipped.sum(axis=0), n, out=self.mean.copy(), where=has_data)
+        batch_dev = np.where(valid, np.abs(clipped - self.mean), 0.0).sum(axis=0)
+        batch_dev = np.divide(batch_dev, n, out=self.abs_dev.copy(), where=has_data)
+
+        # Bias-corrected gain: the share of the accumulated weight that this block contributes
+        weight = 1.0 - (1.0 - self.weight) * (1.0 - self.alpha) ** n
+        gain = np.divide(weight - self.weight, weight, out=np.zeros_like(weight), where=weight > 0)
+        self.mean += gain * (batch_mean - self.mean)
+        self.abs_dev += gain * (batch_dev - self.abs_dev)
+        self.weight = weight
+        self.count += n
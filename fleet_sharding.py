@@ -0,0 +1,185 @@
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import time
+import logging
+import numpy as np
+import anomaly_detection
+from adaptive_mechanisms import adaptive_responses, get_policy
+from vehicle_model import sensors, num_sensors, simulate_sensor_batch, ThreatPredictor
+from latency_histogram import WindowedLatencyHistogram
+import metrics_rollup
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+class VehicleShard:
+    """Simulation and analysis state for one slice of the fleet, owned by a single worker process."""
+
+    def __init__(self, shard_id, n_vehicles, seed, sensor_window=10000, behavioral_window=1000):
+        self.shard_id = shard_id
+        self.n_vehicles = n_vehicles
+        self.rng = np.random.default_rng([seed, shard_id])
+
+        # Per-shard feature state, predictive model (fitted on the first tick) and DRL policy
+        self.threat_predictor = ThreatPredictor(sensor_window, behavioral_window)
+        self.agent = get_policy(num_sensors, len(adaptive_responses))
+
+    def simulate(self):
+        return simulate_sensor_batch(self.n_vehicles, self.rng)
+
+    def detect(self, sensor_batch):
+        # The detector is this process's own copy of anomaly_detection; anomalies are returned, not saved
+        flags, _ = anomaly_detection.detect_anomalies_batch(sensor_batch, save=False)
+        return flags
+
+    def predict(self, sensor_batch):
+        mean_vector, threat_probability = self.threat_predictor.predict(sensor_batch)
+        return mean_vector, threat_probability[0]
+
+    def tick(self):
+        start_time = time.time()
+        sensor_batch = self.simulate()
+        flags = self.detect(sensor_batch)
+        mean_vector, threat_probability = self.predict(sensor_batch)
+        action, response_time = self.agent.select_action(mean_vector)
+        detection_time = time.time() - start_time
+        return sensor_batch, flags, threat_probability, action, detection_time, response_time
+
+def run_shard(shard_id, n_vehicles, ticks, seed, results, chunk_ticks, detector='isolation_forest'):
+    """Worker entry point: run `ticks` ticks for one shard and stream results back in chunks."""
+    logging.getLogger().setLevel(logging.WARNING)
+
+    anomaly_detection.set_detector_engine(detector)
+    shard = VehicleShard(shard_id, n_vehicles, seed)
+    chunk = []
+    detection_latency = WindowedLatencyHistogram(window=metrics_rollup.bucket_seconds)
+    response_latency = WindowedLatencyHistogram(window=metrics_rollup.bucket_seconds)
+    anomaly_counts = {}
+    for tick in range(ticks):
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+        sensor_batch, flags, threat_probability, action, detection_time, response_time = shard.tick()
+        chunk.append((timestamp, sensor_batch, flags, threat_probability, action))
+
+        # Per-second metrics for the parent's rollup
+        bucket = metrics_rollup.bucket_start()
+        detection_latency.record(detection_time, bucket)
+        response_latency.record(response_time, bucket)
+        anomaly_counts[bucket] = anomaly_counts.get(bucket, 0) + (1.0 if flags.any() else 0.0)
+        if len(chunk) >= chunk_ticks or tick == ticks - 1:
+            timestamps, batches, flags, threats, actions = zip(*chunk)
+            results.put({
+                'shard_id': shard_id,
+                'timestamps': list(timestamps),
+                'sensor_values': np.stack(batches),   # (chunk, n_vehicles, num_sensors)
+                'anomaly_flags': np.stack(flags),     # (chunk, n_vehicles, num_sensors)
+                'threat_probability': np.array(threats),
+                'actions': np.array(actions),
+                'detection_latency': detection_latency,   # 1-second latency histograms of this chunk's ticks
+                'response_latency': response_latency,
+                'anomaly_counts': anomaly_counts,
+            })
+            chunk = []
+            detection_latency = WindowedLatencyHistogram(window=metrics_rollup.bucket_seconds)
+            response_latency = WindowedLatencyHistogram(window=metrics_rollup.bucket_seconds)
+            anomaly_counts = {}
+    results.put({'shard_id': shard_id, 'done': True})
+
+def merge_chunk(chunk, sensor_writer, performance_metrics):
+    """Fold one worker chunk into the shared database and performance metrics."""
+    rows = []
+    anomaly_rows = []
+    for timestamp, batch, flags in zip(chunk['timestamps'], chunk['sensor_values'], chunk['anomaly_flags']):
+        rows.extend((timestamp, sensor, float(value))
+                    for vehicle_values in batch
+                    for sensor, value in zip(sensors, vehicle_values))
+        for v, s in zip(*np.nonzero(flags)):
+            anomaly_rows.append((timestamp, sensors[s], float(batch[v, s]), timestamp))
+    sensor_writer.write_many(rows)
+    if anomaly_rows:
+        anomaly_detection.save_anomalies_to_db(anomaly_rows)
+
+    performance_metrics.merge_detection_metrics(chunk['detection_latency'], chunk['response_latency'], chunk['anomaly_counts'],
+                                                1.0 if chunk['anomaly_flags'][-1].any() else 0.0)
+
+def run_sharded(n_vehicles=256, ticks=100, n_workers=None, seed=42, chunk_ticks=10, detector='isolation_forest'):
+    """Split `n_vehicles` across worker processes, run `ticks` ticks and merge the results in this process."""
+    from performance_metrics import PerformanceMetrics
+    from sensor_writer import SensorDataWriter
+    from sensor_rollup import SensorRollup
+
+    n_workers = min(n_workers or os.cpu_count() or 1, n_vehicles)
+    shard_sizes = [len(s) for s in np.array_split(np.arange(n_vehicles), n_workers)]
+
+    # Spawned workers start clean: no inherited sqlite connections, CAN buses or torch thread pools
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue(maxsize=4 * n_workers)
+    workers = [ctx.Process(target=run_shard, args=(shard_id, size, ticks, seed, results, chunk_ticks, detector), daemon=True)
+               for shard_id, size in enumerate(shard_sizes)]
+
+    sensor_writer = SensorDataWriter('racing_vehicle_db.sqlite', rollup=SensorRollup())
+    sensor_writer.start()
+    performance_metrics = PerformanceMetrics()
+
+    # One compute thread per worker; parallelism comes from the process count. OpenMP and BLAS read
+    # this when numpy (and torch, if the policy is converted from a checkpoint) is first imported,
+    # so it has to be in the environment the workers are spawned with
+    omp_threads = os.environ.get('OMP_NUM_THREADS')
+    os.environ['OMP_NUM_THREADS'] = '1'
+    start = time.perf_counter()
+    try:
+        for worker in workers:
+            worker.start()
+    finally:
+        if omp_threads is None:
+            del os.environ['OMP_NUM_THREADS']
+        else:
+            os.environ['OMP_NUM_THREADS'] = omp_threads
+
+    vehicle_ticks = 0
+    running = len(workers)
+    try:
+        while running:
+            try:
+                chunk = results.get(timeout=1)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    logging.error("All shard workers exited before reporting completion.")
+                    break
+                continue
+            if chunk.get('done'):
+                running -= 1
+                continue
+            merge_chunk(chunk, sensor_writer, performance_metrics)
+            vehicle_ticks += chunk['sensor_values'].shape[0] * chunk['sensor_values'].shape[1]
+        elapsed = time.perf_counter() - start
+    finally:
+        for worker in workers:
+            worker.join()
+        sensor_writer.stop()
+        performance_metrics.rollup.stop()
+
+    return {
+        'n_workers': n_workers,
+        'n_vehicles': n_vehicles,
+        'ticks': ticks,
+        'elapsed_s': elapsed,
+        'ticks_per_sec': ticks / elapsed if elapsed > 0 else float('inf'),
+        'vehicle_ticks_per_sec': vehicle_ticks / elapsed if elapsed > 0 else float('inf'),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the fleet simulation sharded across CPU cores")
+    parser.add_argument('--vehicles', type=int, default=256, help="Total number of simulated vehicles")
+    parser.add_argument('--ticks', type=int, default=100, help="Number of ticks every shard runs")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument('--seed', type=int, default=42, help="Base random seed; each shard derives its own stream")
+    parser.add_argument('--detector', choices=sorted(anomaly_detection.detector_engines), default='isolation_forest',
+                        help="Anomaly detection engine used by every shard")
+    parser.add_argument('--chunk-ticks', type=int, default=10, help="Ticks per result chunk sent back to the parent")
+    args = parser.parse_args()
+
+    report = run_sharded(args.vehicles, args.ticks, args.workers, args.seed, args.chunk_ticks, args.detector)
+    print(f"{report['n_vehicles']} vehicles on {report['n_workers']} workers: "
+          f"{report['ticks_per_sec']:.1f} ticks/sec, {report['vehicle_ticks_per_sec']:.1f} vehicle-ticks/sec")
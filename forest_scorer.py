@@ -0,0 +1,117 @@
+import numpy as np
+
+def average_path_length(n_samples):
+    """Average path length of an unsuccessful BST search in a tree built on n_samples points, c(n)."""
+    n_samples = np.asarray(n_samples, dtype=float)
+    result = np.zeros_like(n_samples)
+    result[n_samples == 2] = 1.0
+    large = n_samples > 2
+    result[large] = (2.0 * (np.log(n_samples[large] - 1.0) + np.euler_gamma)
+                     - 2.0 * (n_samples[large] - 1.0) / n_samples[large])
+    return result
+
+class FlatIsolationForest:
+    """A fitted IsolationForest flattened into contiguous NumPy arrays.
+
+    All trees are concatenated into one node table: split feature, threshold, left/right child
+    (leaves point at themselves) and, for leaves, the path length contribution depth + c(n_leaf).
+    Scoring a batch walks every (sample, tree) pair down one level per step, so a whole forest is
+    evaluated in max_depth rounds of array gathers instead of one Python call per estimator.
+    """
+
+    def __init__(self, feature, threshold, left, right, leaf_path_length, roots, max_depth,
+                 average_path_length_max_samples, offset):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_path_length = leaf_path_length
+        self.roots = roots
+        self.max_depth = max_depth
+        self.average_path_length_max_samples = average_path_length_max_samples
+        self.offset = offset
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """Export a fitted sklearn IsolationForest."""
+        features, thresholds, lefts, rights, leaf_lengths, roots = [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree, tree_features in zip(model.estimators_, model.estimators_features_):
+            t = tree.tree_
+            n_nodes = t.node_count
+            is_leaf = t.children_left == -1
+            node_ids = np.arange(n_nodes)
+
+            # Node depths, parents always precede their children in sklearn's node order
+            depth = np.zeros(n_nodes)
+            for node in range(n_nodes):
+                if not is_leaf[node]:
+                    depth[t.children_left[node]] = depth[node] + 1
+                    depth[t.children_right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            # Map tree-local feature indices back to the model's input columns
+            feature = np.where(is_leaf, 0, np.asarray(tree_features)[np.maximum(t.feature, 0)])
+            features.append(feature)
+            thresholds.append(np.where(is_leaf, np.inf, t.threshold))
+            lefts.append(np.where(is_leaf, node_ids, t.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, t.children_right) + offset)
+            leaf_lengths.append(np.where(is_leaf, depth + average_path_length(t.n_node_samples), 0.0))
+            roots.append(offset)
+            offset += n_nodes
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            leaf_path_length=np.concatenate(leaf_lengths),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max_depth,
+            average_path_length_max_samples=float(average_path_length([model.max_samples_])[0]),
+            offset=float(model.offset_),
+        )
+
+    def arrays(self):
+        """The flat representation as a dict of arrays, e.g. for np.savez."""
+        return {
+            'feature': self.feature, 'threshold': self.threshold, 'left': self.left, 'right': self.right,
+            'leaf_path_length': self.leaf_path_length, 'roots': self.roots,
+            'max_depth': np.array(self.max_depth),
+            'average_path_length_max_samples': np.array(self.average_path_length_max_samples),
+            'offset': np.array(self.offset),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=''):
+        return cls(
+            feature=arrays[prefix + 'feature'], threshold=arrays[prefix + 'threshold'],
+            left=arrays[prefix + 'left'], right=arrays[prefix + 'right'],
+            leaf_path_length=arrays[prefix + 'leaf_path_length'], roots=arrays[prefix + 'roots'],
+            max_depth=int(arrays[prefix + 'max_depth']),
+            average_path_length_max_samples=float(arrays[prefix + 'average_path_length_max_samples']),
+            offset=float(arrays[prefix + 'offset']),
+        )
+
+    def path_lengths(self, X):
+        """Sum over trees of the path length of every sample, shape (n_samples,)."""
+        # sklearn's trees compare float32 inputs against their thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.leaf_path_length[nodes].sum(axis=1)
+
+    def score_samples(self, X):
+        """Equivalent of IsolationForest.score_samples (lower is more abnormal)."""
+        denominator = len(self.roots) * self.average_path_length_max_samples
+        if denominator == 0:
+            return -np.ones(len(X))
+        return -(2.0 ** (-self.path_lengths(X) / denominator))
+
+    def decision_function(self, X):
+        """Equivalent of IsolationForest.decision_function (negative means anomalous)."""
+        return self.score_samples(X) - self.offset
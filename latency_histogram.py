@@ -0,0 +1,216 @@
+import threading
+import time
+import numpy as np
+
+class LatencyHistogram:
+    """Fixed-memory latency histogram with log-linear buckets, in the style of HdrHistogram.
+
+    Latencies are recorded in seconds and stored as integer nanoseconds. Values below
+    2**precision_bits ns get one bucket each; every further power of two is split into
+    2**(precision_bits - 1) equal buckets, so a reported value is within 2**-(precision_bits - 1)
+    (1.6% at the default of 7 bits) of the recorded one. Values above `highest` seconds are
+    clamped into the last bucket. record() is O(1) under the histogram's lock, and histograms
+    with the same configuration merge by adding their counts, across threads or (after pickling)
+    across processes.
+    """
+
+    def __init__(self, highest=60.0, precision_bits=7):
+        self.highest = highest
+        self.precision_bits = precision_bits
+        self.sub_bucket_count = 1 << precision_bits
+        self.half_count = self.sub_bucket_count >> 1
+        self.highest_ns = int(highest * 1e9)
+        self.counts = np.zeros(self._index(self.highest_ns) + 1, dtype=np.int64)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _index(self, value_ns):
+        if value_ns < self.sub_bucket_count:
+            return value_ns
+        exponent = value_ns.bit_length() - self.precision_bits
+        return self.sub_bucket_count + (exponent - 1) * self.half_count + (value_ns >> exponent) - self.half_count
+
+    def _bucket_upper_ns(self, index):
+        # Highest value that lands in bucket `index`
+        if index < self.sub_bucket_count:
+            return index
+        exponent = (index - self.sub_bucket_count) // self.half_count + 1
+        mantissa = (index - self.sub_bucket_count) % self.half_count + self.half_count
+        return ((mantissa + 1) << exponent) - 1
+
+    def record(self, seconds):
+        """Record one latency in seconds."""
+        value_ns = min(max(int(seconds * 1e9), 0), self.highest_ns)
+        index = self._index(value_ns)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total_ns += value_ns
+            if self.min_ns is None or value_ns < self.min_ns:
+                self.min_ns = value_ns
+            if value_ns > self.max_ns:
+                self.max_ns = value_ns
+
+    def record_many(self, seconds):
+        """Record an array of latencies in seconds."""
+        values_ns = np.clip((np.asarray(seconds, dtype=float).ravel() * 1e9).astype(np.int64), 0, self.highest_ns)
+        if not len(values_ns):
+            return
+        # Vectorised _index(): frexp's exponent is the bit length for the exactly representable values here
+        exponents = np.maximum(np.frexp(values_ns.astype(float))[1] - self.precision_bits, 0)
+        indices = np.where(values_ns < self.sub_bucket_count, values_ns,
+                           self.sub_bucket_count + (exponents - 1) * self.half_count
+                           + (values_ns >> exponents) - self.half_count)
+        with self.lock:
+            np.add.at(self.counts, indices, 1)
+            self.count += len(values_ns)
+            self.total_ns += int(values_ns.sum())
+            low, high = int(values_ns.min()), int(values_ns.max())
+            if self.min_ns is None or low < self.min_ns:
+                self.min_ns = low
+            if high > self.max_ns:
+                self.max_ns = high
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same configuration into this one."""
+        if (other.highest, other.precision_bits) != (self.highest, self.precision_bits):
+            raise ValueError("Cannot merge latency histograms with different configurations")
+        with other.lock:
+            counts = other.counts.copy()
+            count, total_ns, min_ns, max_ns = other.count, other.total_ns, other.min_ns, other.max_ns
+        with self.lock:
+            self.counts += counts
+            self.count += count
+            self.total_ns += total_ns
+            if min_ns is not None and (self.min_ns is None or min_ns < self.min_ns):
+                self.min_ns = min_ns
+            self.max_ns = max(self.max_ns, max_ns)
+        return self
+
+    def copy(self):
+        histogram = LatencyHistogram(self.highest, self.precision_bits)
+        return histogram.merge(self)
+
+    def reset(self):
+        with self.lock:
+            self.counts[:] = 0
+            self.count = 0
+            self.total_ns = 0
+            self.min_ns = None
+            self.max_ns = 0
+
+    def percentile(self, percent):
+        """Latency in seconds at or below which `percent` percent of the recorded values fall."""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, int(np.ceil(percent / 100.0 * self.count)))
+            index = int(np.searchsorted(np.cumsum(self.counts), rank))
+            return min(self._bucket_upper_ns(index), self.max_ns) / 1e9
+
+    def mean(self):
+        return self.total_ns / self.count / 1e9 if self.count else 0.0
+
+    def summary(self):
+        """Count, mean, min, p50/p90/p99/p99.9 and max, in seconds."""
+        return {
+            'count': self.count,
+            'mean': self.mean(),
+            'min': (self.min_ns or 0) / 1e9,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+            'max': self.max_ns / 1e9,
+        }
+
+class WindowedLatencyHistogram:
+    """A LatencyHistogram per fixed time window, keeping the last `history` windows.
+
+    Windows are aligned to multiples of `window` seconds of wall-clock time, so windows recorded
+    in different threads or processes line up and can be merged.
+    """
+
+    def __init__(self, window=10.0, history=60, **histogram_kwargs):
+        self.window = window
+        self.history = history
+        self.histogram_kwargs = histogram_kwargs
+        self.lock = threading.Lock()
+        self.windows = {}  # window start (epoch seconds) -> LatencyHistogram
+        self.total = LatencyHistogram(**histogram_kwargs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def _window(self, now):
+        start = (now if now is not None else time.time()) // self.window * self.window
+        with self.lock:
+            histogram = self.windows.get(start)
+            if histogram is None:
+                histogram = self.windows[start] = LatencyHistogram(**self.histogram_kwargs)
+                # Drop the oldest windows beyond the retained history
+                for old_start in sorted(self.windows)[:-self.history]:
+                    del self.windows[old_start]
+            return histogram
+
+    def record(self, seconds, now=None):
+        self._window(now).record(seconds)
+        self.total.record(seconds)
+
+    def record_many(self, seconds, now=None):
+        self._window(now).record_many(seconds)
+        self.total.record_many(seconds)
+
+    def merge(self, other):
+        """Merge another windowed histogram window by window."""
+        with other.lock:
+            windows = list(other.windows.items())
+        for start, histogram in windows:
+            self._window(start).merge(histogram)
+        self.total.merge(other.total)
+        return self
+
+    def pop_windows(self, before):
+        """Remove and return [(window start, LatencyHistogram)] for the windows starting before `before`, oldest first."""
+        with self.lock:
+            starts = sorted(start for start in self.windows if start < before)
+            return [(start, self.windows.pop(start)) for start in starts]
+
+    def window_summaries(self):
+        """[(window start, summary)] for every retained window, oldest first."""
+        with self.lock:
+            windows = sorted(self.windows.items())
+        return [(start, histogram.summary()) for start, histogram in windows]
+
+    def recent(self, windows=1, now=None):
+        """A LatencyHistogram merging the last `windows` windows up to and including the current one."""
+        end = (now if now is not None else time.time()) // self.window * self.window
+        start = end - (windows - 1) * self.window
+        merged = LatencyHistogram(**self.histogram_kwargs)
+        with self.lock:
+            selected = [histogram for window_start, histogram in self.windows.items() if start <= window_start <= end]
+        for histogram in selected:
+            merged.merge(histogram)
+        return merged
+
+    def summary(self):
+        """Summary over everything recorded, including windows that have since been dropped."""
+        return self.total.summary()
@@ -5,6 +5,7 @@ import shutil
 import os
 from cryptography.fernet import Fernet
 from performance_metrics import PerformanceMetrics
+import db_pool
 import psutil
 import tkinter as tk
 
@@ -73,6 +74,7 @@ def backup_and_encrypt_db(src_path, backup_path, key):
         print(f"Source file not found: {src_path}")
         return
     print(f"Backing up and encrypting database: {src_path}")
+    db_pool.checkpoint(src_path)  # Fold pending WAL pages into the file before copying it
     shutil.copy(src_path, backup_path)
     encrypt_file(backup_path, key)
 
@@ -84,6 +86,7 @@ def run_script(script_name):
 # Encrypt database before running scripts
 def encrypt_db(file_path, key):
     if os.path.exists(file_path):
+        db_pool.checkpoint(file_path)  # Committed pages may still be in the WAL, which encrypt_file does not read
         encrypt_file(file_path, key)
     else:
         print(f"File not found: {file_path}")
@@ -112,7 +115,8 @@ def continuous_performance_update(metrics):
     while True:
         performance_data = metrics.update_metrics_from_db()
         print("Performance Metrics Updated:")
-        print(performance_data)
+        for name, value in performance_data.items():
+            print(f"  {name}: {value}")
         time.sleep(5)  # Adjust sleep time as necessary
 
 # Initialize performance metrics
@@ -0,0 +1,103 @@
+import threading
+import time
+import logging
+import sensor_store
+from latency_histogram import WindowedLatencyHistogram
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Width of one rollup bucket in seconds; buckets are aligned to wall-clock seconds
+bucket_seconds = 1.0
+
+def bucket_start(now=None):
+    """Start of the rollup bucket containing `now` (epoch seconds)."""
+    now = time.time() if now is None else now
+    return now // bucket_seconds * bucket_seconds
+
+class MetricsRollup:
+    """Aggregates per-tick detection metrics into 1-second buckets and writes one summary row per bucket.
+
+    record() only updates in-memory latency histograms and an anomaly counter for the current
+    bucket. A background thread closes buckets once they are `flush_delay` seconds old and writes
+    all of them to performance_rollup_1s in a single transaction, so the number of rows written
+    depends on elapsed time, not on the tick rate. Metrics merged in after their bucket was
+    flushed produce a second row for the same bucket_start.
+    """
+
+    def __init__(self, db_path=sensor_store.metrics_db_path, flush_interval=1.0, flush_delay=2.0, history=600):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.flush_delay = flush_delay
+        self.detection = WindowedLatencyHistogram(window=bucket_seconds, history=history)
+        self.response = WindowedLatencyHistogram(window=bucket_seconds, history=history)
+        self.anomalies = {}  # bucket start -> anomaly count
+        self.lock = threading.Lock()
+        self.rows_written = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        # Start the background flush thread
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='MetricsRollup', daemon=True)
+        self.thread.start()
+        logging.info("Performance metrics rollup started.")
+
+    def stop(self):
+        # Stop the flush thread and write every open bucket
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        self.flush(float('inf'))
+        logging.info(f"Performance metrics rollup stopped ({self.rows_written} rows written).")
+
+    def record(self, detection_time, response_time, anomaly, now=None):
+        """Add one tick's detection time, response time (seconds) and anomaly flag or count."""
+        start = bucket_start(now)
+        self.detection.record(detection_time, start)
+        self.response.record(response_time, start)
+        with self.lock:
+            self.anomalies[start] = self.anomalies.get(start, 0) + anomaly
+
+    def merge(self, detection, response, anomalies):
+        """Merge 1-second windowed histograms and {bucket start: anomaly count} recorded elsewhere."""
+        self.detection.merge(detection)
+        self.response.merge(response)
+        with self.lock:
+            for start, count in anomalies.items():
+                self.anomalies[start] = self.anomalies.get(start, 0) + count
+
+    def flush(self, before=None):
+        """Write one row for every bucket that starts before `before` (default: now - flush_delay)."""
+        before = bucket_start(time.time() - self.flush_delay) if before is None else before
+        detection = dict(self.detection.pop_windows(before))
+        response = dict(self.response.pop_windows(before))
+        with self.lock:
+            anomalies = {start: self.anomalies.pop(start) for start in list(self.anomalies) if start < before}
+
+        rows = []
+        for start in sorted(detection):
+            d = detection[start].summary()
+            r = response[start].summary() if start in response else dict.fromkeys(d, 0.0)
+            rows.append((int(start), time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start)), d['count'],
+                         anomalies.get(start, 0),
+                         d['mean'], d['min'], d['max'], d['p50'], d['p90'], d['p99'],
+                         r['mean'], r['min'], r['max'], r['p50'], r['p90'], r['p99']))
+        if not rows:
+            return 0
+        try:
+            sensor_store.insert_performance_rollups(rows, self.db_path)
+            self.rows_written += len(rows)
+        except Exception as e:
+            logging.error(f"Error writing performance rollup rows to database: {e}")
+        return len(rows)
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.flush_interval)
+            self.flush()
@@ -0,0 +1,111 @@
+import threading
+import time
+import logging
+import numpy as np
+import anomaly_detection
+from behavioral_features import RollingSensorStats
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+class BackgroundRefitter:
+    """Watches the IsolationForest score distribution and refits drifted sensors on a background thread.
+
+    Detection only pays for observe(), which copies the latest scores into fixed-size windows. A
+    baseline window is captured right after each (re)fit; when the mean score of the recent window
+    moves more than `drift_threshold` baseline standard deviations away, the drifted sensors are
+    refitted from the database on this thread. The new scaler/model pairs, and their flat-backend
+    exports, are built here in fresh dicts and installed with reference assignments, so detection
+    keeps using the old models until the swap, never sees a half-updated set and never exports a
+    forest itself.
+    """
+
+    def __init__(self, baseline_size=2000, recent_size=2000, drift_threshold=0.5,
+                 check_interval=5.0, min_refit_interval=30.0):
+        self.num_sensors = anomaly_detection.num_sensors
+        self.baseline_size = baseline_size
+        self.recent_size = recent_size
+        self.drift_threshold = drift_threshold
+        self.check_interval = check_interval
+        self.min_refit_interval = min_refit_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.refits = 0
+        self.last_refit = float('-inf')
+        self._reset_windows()
+
+    def _reset_windows(self):
+        self.baseline = RollingSensorStats(self.num_sensors, window=self.baseline_size)
+        self.recent = RollingSensorStats(self.num_sensors, window=self.recent_size)
+
+    def start(self):
+        # Start the refit thread and register with anomaly_detection so it receives scores
+        self.thread = threading.Thread(target=self._run, name='BackgroundRefitter', daemon=True)
+        self.thread.start()
+        anomaly_detection.refitter = self
+        logging.info("Background anomaly model refitter started.")
+
+    def stop(self):
+        if anomaly_detection.refitter is self:
+            anomaly_detection.refitter = None
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        logging.info("Background anomaly model refitter stopped.")
+
+    def observe(self, scores):
+        """Record a block of (n_rows, num_sensors) scores from detection; cheap and never trains."""
+        scores = np.asarray(scores, dtype=float).reshape(-1, self.num_sensors)
+        scores = scores[~np.isnan(scores).any(axis=1)]
+        if not len(scores):
+            return
+        with self.lock:
+            # The baseline fills once after each refit and is then frozen
+            missing = self.baseline_size - self.baseline.count
+            if missing > 0:
+                self.baseline.update(scores[:missing])
+            self.recent.update(scores)
+
+    def drifted_sensors(self):
+        """Return the sensors whose recent mean score moved away from the baseline."""
+        with self.lock:
+            if self.baseline.count < self.baseline_size or self.recent.count < self.recent_size:
+                return []
+            baseline_mean = self.baseline.mean()
+            baseline_std = np.maximum(self.baseline.std(), 1e-6)
+            recent_mean = self.recent.mean()
+        shift = np.abs(recent_mean - baseline_mean) / baseline_std
+        return [sensor for sensor, s in zip(anomaly_detection.sensors, shift) if s > self.drift_threshold]
+
+    def refit(self, drifted):
+        """Refit the drifted sensors from recent history and hot-swap the complete model set."""
+        start = time.perf_counter()
+        models = dict(anomaly_detection.sensor_models)
+        refitted = []
+        for sensor in drifted:
+            values = anomaly_detection.fetch_sensor_history(sensor)
+            if len(values) >= anomaly_detection.min_history:
+                models[sensor] = anomaly_detection.fit_sensor_model(values)
+                refitted.append(sensor)
+
+        # Export the refitted forests for the flat backend here rather than on the next detection tick
+        flat_models = anomaly_detection.export_flat_models(models, refitted, anomaly_detection.flat_sensor_models)
+        anomaly_detection.install_sensor_models(models, flat_models)
+        with self.lock:
+            self._reset_windows()
+        self.refits += 1
+        self.last_refit = time.monotonic()
+        logging.info(f"Refitted anomaly models for {drifted} in {time.perf_counter() - start:.2f} s.")
+
+    def _run(self):
+        while not self.stop_event.wait(self.check_interval):
+            if time.monotonic() - self.last_refit < self.min_refit_interval:
+                continue
+            try:
+                drifted = self.drifted_sensors()
+                if drifted:
+                    self.refit(drifted)
+            except Exception as e:
+                logging.error(f"Error refitting anomaly models: {e}")
@@ -0,0 +1,107 @@
+import os
+import time
+import numpy as np
+
+# Default location of the exported DRL policy weights
+policy_weights_path = 'drl_policy.npz'
+
+class NumpyPolicy:
+    """The DRL policy MLP evaluated with NumPy from exported weights, so acting never imports torch.
+
+    Weights use the keys of DRLAgent's nn.Sequential state_dict ('0.weight', '0.bias', ...),
+    with every Linear layer followed by a ReLU except the last. publish_weights() builds a new
+    layer list and installs it with a single reference assignment, so a call that is already
+    running keeps the weights it started with.
+    """
+
+    def __init__(self, layers):
+        # layers: [(weight transposed to (in, out), bias)], contiguous float32
+        self.layers = layers
+        self.state_dim = layers[0][0].shape[0]
+        self.action_dim = layers[-1][0].shape[1]
+        self.policy_version = 0
+
+        # Response time bookkeeping in nanoseconds, as in DRLAgent
+        self.last_call_ns = 0
+        self.last_state_ns = 0
+        self.total_calls = 0
+        self.total_states = 0
+        self.total_ns = 0
+
+    @staticmethod
+    def _layers_from(weights):
+        weights = {name: np.asarray(value.detach().cpu().numpy() if hasattr(value, 'detach') else value)
+                   for name, value in weights.items()}
+        indices = sorted({int(name.split('.')[0]) for name in weights})
+        return [(np.ascontiguousarray(weights[f'{i}.weight'].T, dtype=np.float32),
+                 np.ascontiguousarray(weights[f'{i}.bias'], dtype=np.float32))
+                for i in indices]
+
+    @classmethod
+    def from_weights(cls, weights):
+        """Build a policy from a state_dict-style mapping of arrays or tensors."""
+        return cls(cls._layers_from(weights))
+
+    @classmethod
+    def load(cls, path=policy_weights_path):
+        with np.load(path) as weights:
+            return cls.from_weights(dict(weights))
+
+    @classmethod
+    def random(cls, state_dim, action_dim, hidden_dims=(128, 64), seed=None):
+        """An untrained policy initialised like torch's nn.Linear (uniform in +-1/sqrt(fan_in))."""
+        rng = np.random.default_rng(seed)
+        dims = [state_dim, *hidden_dims, action_dim]
+        weights = {}
+        for layer, (fan_in, fan_out) in enumerate(zip(dims[:-1], dims[1:])):
+            bound = 1.0 / np.sqrt(fan_in)
+            weights[f'{2 * layer}.weight'] = rng.uniform(-bound, bound, size=(fan_out, fan_in))
+            weights[f'{2 * layer}.bias'] = rng.uniform(-bound, bound, size=fan_out)
+        return cls.from_weights(weights)
+
+    def policy_weights(self):
+        """The weights as a state_dict-style mapping of NumPy arrays."""
+        return {name: array for i, (weight_t, bias) in enumerate(self.layers)
+                for name, array in ((f'{2 * i}.weight', weight_t.T.copy()), (f'{2 * i}.bias', bias.copy()))}
+
+    def save(self, path=policy_weights_path):
+        # Write to a temporary file first so a concurrent reader never sees a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self.policy_weights())
+        os.replace(tmp_path, path)
+
+    def publish_weights(self, weights):
+        """Install new weights (arrays or tensors) with a single reference assignment."""
+        self.layers = self._layers_from(weights)
+        self.policy_version += 1
+
+    def q_values(self, states):
+        hidden = np.asarray(states, dtype=np.float32).reshape(-1, self.state_dim)
+        layers = self.layers
+        for weight_t, bias in layers[:-1]:
+            hidden = hidden @ weight_t
+            hidden += bias
+            np.maximum(hidden, 0.0, out=hidden)
+        weight_t, bias = layers[-1]
+        return hidden @ weight_t + bias
+
+    def select_actions(self, states):
+        """Select an action for every row of an (n, state_dim) batch; returns (actions, response_time in s)."""
+        start_ns = time.perf_counter_ns()  # Start timing
+        actions = np.argmax(self.q_values(states), axis=1)
+        elapsed_ns = time.perf_counter_ns() - start_ns  # End timing
+
+        # Record per-call and per-state response times
+        n = len(actions)
+        self.last_call_ns = elapsed_ns
+        self.last_state_ns = elapsed_ns // max(n, 1)
+        self.total_calls += 1
+        self.total_states += n
+        self.total_ns += elapsed_ns
+
+        return actions, elapsed_ns / 1e9
+
+    def select_action(self, state):
+        actions, response_time = self.select_actions(state)
+        return int(actions[0]), response_time
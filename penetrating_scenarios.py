@@ -96,3 +96,30 @@ def scenario_data_poisoning(sensor_values):
         if random.random() < 0.05:
             sensor_values[i] += poisoning_factor
     return sensor_values
+
+# Batched scenario variants
+#
+# The functions below apply the same attacks as scenarios 1-3 to a whole
+# (n_vehicles, n_sensors) NumPy array at once, drawing from a seeded
+# np.random.Generator so a fleet simulation tick costs a handful of array
+# operations instead of one Python loop iteration per value.
+#
+
+def scenario_increase_values_batch(sensor_values, rng):
+    """Vectorised scenario_increase_values for an (n_vehicles, n_sensors) array."""
+    mask = rng.random(sensor_values.shape) < 0.05
+    factors = rng.uniform(1.5, 3.0, size=sensor_values.shape)
+    sensor_values[mask] *= factors[mask]  # Increase sensor value
+    return sensor_values
+
+def scenario_sensor_failure_batch(sensor_values, rng):
+    """Vectorised scenario_sensor_failure for an (n_vehicles, n_sensors) array."""
+    mask = rng.random(sensor_values.shape) < 0.1  # 10% chance of failure
+    sensor_values[mask] = -999  # Example of a failure value
+    return sensor_values
+
+def scenario_noise_injection_batch(sensor_values, rng):
+    """Vectorised scenario_noise_injection for an (n_vehicles, n_sensors) array."""
+    noise_level = 5  # Adjust noise level as needed
+    sensor_values += rng.uniform(-noise_level, noise_level, size=sensor_values.shape)
+    return sensor_values
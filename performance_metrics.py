@@ -2,10 +2,13 @@ import can
 import time
 import threading
 import logging
-import sqlite3
-from adaptive_mechanisms import DRLAgent
+from adaptive_mechanisms import get_policy
 import os
-from datetime import datetime
+import sensor_store
+import sensor_archive
+import db_pool
+from latency_histogram import WindowedLatencyHistogram
+from metrics_rollup import MetricsRollup
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -17,21 +20,36 @@ class PerformanceMetrics:
         self.racing_db_path = os.path.join(script_dir, 'racing_vehicle_db.sqlite')
         self.metrics_db_path = os.path.join(script_dir, 'metrics_db.sqlite')
 
-        self.detection_times = []
-        self.response_times = []
-        self.threat_detection_rate = []
+        # Fixed-memory latency histograms, one per 10 s window, and the latest threat detection rate
+        self.detection_latency = WindowedLatencyHistogram()
+        self.response_latency = WindowedLatencyHistogram()
+        self.threat_detection_rate = 0.0
         self.lock = threading.Lock()
         self.bus = None
-        self.drl_agent = DRLAgent(state_dim=8, action_dim=8)  # Initialize DRLAgent
+
+        # Incremental detection rate state: rowid high-water mark, last value per sensor and counters
+        self.detection_rate_lock = threading.Lock()
+        self.detection_rate_rowid = 0
+        self.detection_rate_page_size = 10000
+        self.last_sensor_values = {}
+        self.value_changes = 0
+        self.value_comparisons = 0
+        self.sensor_rows_processed = 0
+        self.latest_sensor_timestamp = None
+        self.seed_detection_rate_from_archive()
+        self.drl_agent = get_policy(state_dim=8, action_dim=8)  # Shared NumPy DRL policy
 
         # Initialize metrics database
         self.setup_metrics_db()
 
+        # Per-second summaries of the detection metrics, flushed to metrics_db in the background
+        self.rollup = MetricsRollup(self.metrics_db_path)
+        self.rollup.start()
+
     def setup_metrics_db(self):
         # Create metrics table if it does not exist
-        self.metrics_conn = sqlite3.connect(self.metrics_db_path)  # Connect to the metrics_db
-        self.metrics_cursor = self.metrics_conn.cursor()
-        self.metrics_cursor.execute('''
+        metrics_conn = db_pool.get_connection(self.metrics_db_path)  # Pooled connection to the metrics_db
+        metrics_conn.execute('''
             CREATE TABLE IF NOT EXISTS performance_metrics (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
@@ -40,7 +58,8 @@ class PerformanceMetrics:
                 threat_detection_rate REAL
             )
         ''')
-        self.metrics_conn.commit()
+        metrics_conn.commit()
+        sensor_store.migrate_schema(metrics_conn, 'metrics')
 
     def start_can_communication(self):
         self.bus = can.interface.Bus(channel='virtual_can', interface='virtual')
@@ -50,10 +69,8 @@ class PerformanceMetrics:
     def stop_can_communication(self):
         if self.bus:
             self.bus.shutdown()
-        if hasattr(self, 'db_conn'):
-            self.db_conn.close()  # Close the racing_vehicle_db connection
-        if hasattr(self, 'metrics_conn'):
-            self.metrics_conn.close()  # Close the metrics_db connection
+        self.rollup.stop()  # Write the open per-second buckets before the connections close
+        db_pool.close_all()  # Close the pooled racing_vehicle_db and metrics_db connections
 
     def receive_data(self):
         while True:
@@ -69,101 +86,103 @@ class PerformanceMetrics:
                     self.update_plot_data(data)
 
     def update_detection_metrics(self, data):
+        # Each histogram records in O(1) under its own lock
+        self.detection_latency.record(data[0])
+        self.response_latency.record(data[1])
+        self.rollup.record(data[0], data[1], data[2])
         with self.lock:
-            self.detection_times.append(data[0])
-            self.response_times.append(data[1])
             self.threat_detection_rate = data[2]
 
-    def fetch_sensor_data_with_timestamps(self):
-        """Fetch sensor data with timestamps from the database."""
-        with sqlite3.connect(self.racing_db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT sensor, value, timestamp FROM sensor_data ORDER BY timestamp")
-            return cursor.fetchall()
+    def merge_detection_metrics(self, detection_latency, response_latency, anomaly_counts, threat_detection_rate):
+        """Fold metrics recorded elsewhere (another thread or a worker process) into these.
+
+        The histograms must use the rollup's 1-second windows; anomaly_counts maps window start to count.
+        """
+        self.detection_latency.merge(detection_latency)
+        self.response_latency.merge(response_latency)
+        self.rollup.merge(detection_latency, response_latency, anomaly_counts)
+        with self.lock:
+            self.threat_detection_rate = threat_detection_rate
 
     def get_response_time_from_adaptive_mechanisms(self, state):
         # Use DRLAgent to get response time
         _, response_time = self.drl_agent.select_action(state)
         return response_time
 
-    def parse_timestamp(self, timestamp):
-        """Convert timestamp to Unix timestamp if necessary."""
-        if isinstance(timestamp, str):
-            try:
-                dt = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S')
-                return dt.timestamp()  # Convert to Unix timestamp
-            except ValueError:
-                return None
-        elif isinstance(timestamp, (int, float)):  # Handle cases where timestamp is already a Unix timestamp
-            return float(timestamp)
-        else:
-            return None
+    def seed_detection_rate_from_archive(self):
+        """Start the detection rate counters from the rows already moved to sensor_archive."""
+        try:
+            for sensor, (changes, comparisons, last_value) in sensor_archive.value_change_counts().items():
+                self.value_changes += changes
+                self.value_comparisons += comparisons
+                self.last_sensor_values[sensor] = last_value
+        except Exception as e:
+            logging.error(f"Error reading sensor archive: {e}")
 
     def calculate_detection_rate(self):
-        """Calculate detection rate based on sensor value changes over time."""
-        data_with_timestamps = self.fetch_sensor_data_with_timestamps()
-
-        if not data_with_timestamps:
-            return 0
-
-        # Filter out records with None values
-        filtered_data = [(sensor, value, timestamp) for sensor, value, timestamp in data_with_timestamps if sensor is not None and value is not None and timestamp is not None]
-
-        if not filtered_data:
-            return 0
-
-        # Convert timestamps to Unix timestamps
-        for i in range(len(filtered_data)):
-            sensor, value, timestamp = filtered_data[i]
-            timestamp = self.parse_timestamp(timestamp)
-            if timestamp is not None:
-                filtered_data[i] = (sensor, value, timestamp)
-            else:
-                filtered_data[i] = (sensor, value, float('inf'))  # Handle invalid timestamps
-
-        # Sort data by sensor and timestamp
-        sorted_data = sorted(filtered_data, key=lambda x: (x[0], x[2]))  # (sensor, timestamp)
-        
-        changes = 0
-        total_comparisons = 0
-
-        # Track the last known value for each sensor
-        last_values = {}
-
-        for sensor, value, timestamp in sorted_data:
-            if sensor in last_values:
-                if last_values[sensor] != value:
-                    changes += 1
-                total_comparisons += 1
-            
-            last_values[sensor] = value
-
-        detection_rate = changes / total_comparisons if total_comparisons > 0 else 0
-        return detection_rate
+        """Calculate detection rate based on sensor value changes over time.
+
+        Incremental: only rows inserted since the previous call are read, page by page in rowid
+        (insertion) order, and each is compared with the last value seen for its sensor.
+        """
+        with self.detection_rate_lock:
+            # sensor_data has no AUTOINCREMENT: if it is ever emptied (sensor_archive and retention keep the
+            # newest row, but a manual cleanup may not) rowids restart at 1
+            max_rowid = sensor_store.fetch_max_sensor_rowid(self.racing_db_path)
+            if max_rowid is None or max_rowid < self.detection_rate_rowid:
+                self.detection_rate_rowid = 0
+
+            while True:
+                rows = sensor_store.fetch_sensor_rows_since(self.detection_rate_rowid, self.detection_rate_page_size,
+                                                            self.racing_db_path)
+                if not rows:
+                    break
+
+                for rowid, sensor, value, timestamp in rows:
+                    # Skip records with None values
+                    if sensor is None or value is None or timestamp is None:
+                        continue
+                    if sensor in self.last_sensor_values:
+                        if self.last_sensor_values[sensor] != value:
+                            self.value_changes += 1
+                        self.value_comparisons += 1
+                    self.last_sensor_values[sensor] = value
+                    self.latest_sensor_timestamp = timestamp
+
+                self.sensor_rows_processed += len(rows)
+                self.detection_rate_rowid = rows[-1][0]
+                if len(rows) < self.detection_rate_page_size:
+                    break
+
+            detection_rate = self.value_changes / self.value_comparisons if self.value_comparisons > 0 else 0
+            return detection_rate
 
     def update_metrics_from_db(self):
-        """Fetch and return metrics from the database."""
+        """Refresh the metrics from the database and return a constant-size summary.
+
+        The database work runs outside self.lock, which is only taken to read the latest
+        threat detection rate.
+        """
+        # Replace `state` with the actual state when calling this method
+        state = [0] * 8  # Dummy state, replace with actual state
+        response_time = self.get_response_time_from_adaptive_mechanisms(state)
+        detection_rate = self.calculate_detection_rate()
+        
+        # Save metrics to metrics_db.sqlite
+        sensor_store.insert_performance_metrics(response_time, response_time, detection_rate, self.metrics_db_path)
+        
         with self.lock:
-            detection_times = self.fetch_sensor_data_with_timestamps()
-            # Replace `state` with the actual state when calling this method
-            state = [0] * 8  # Dummy state, replace with actual state
-            response_time = self.get_response_time_from_adaptive_mechanisms(state)
-            detection_rate = self.calculate_detection_rate()
-            
-            # Save metrics to metrics_db.sqlite
-            with sqlite3.connect(self.metrics_db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO performance_metrics (detection_time, response_time, threat_detection_rate)
-                    VALUES (?, ?, ?)
-                ''', (response_time, response_time, detection_rate))
-                conn.commit()
-            
-            return {
-                'detection_times': detection_times,
-                'response_times': response_time,
-                'threat_detection_rate': detection_rate
-            }
+            threat_detection_rate = self.threat_detection_rate
+        
+        return {
+            'sensor_rows': self.sensor_rows_processed,
+            'latest_sensor_timestamp': self.latest_sensor_timestamp,
+            'detection_latency': self.detection_latency.summary(),
+            'response_latency': self.response_latency.summary(),
+            'latest_threat_detection_rate': threat_detection_rate,
+            'response_times': response_time,
+            'threat_detection_rate': detection_rate
+        }
 
 if __name__ == "__main__":
     performance_metrics = PerformanceMetrics()
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import simulation
+from communication_module import CANSimulation
+from stage_timing import StageTimer
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Marks the end of the tick stream as it travels down the queues
+_END = object()
+
+# Stages in pipeline order; each runs as one or more workers connected by bounded queues
+STAGES = ['detect', 'analyze', 'persist', 'publish']
+
+# Stages that update shared state tick by tick (detector engines, rolling features, imputer, logistic
+# regression, the pending DRL transition) and so must run with a single worker
+STATEFUL_STAGES = {'detect', 'analyze'}
+
+# Workers per stage; a stateless stage given several workers still hands its items downstream in tick order
+DEFAULT_CONCURRENCY = {'detect': 1, 'analyze': 1, 'persist': 1, 'publish': 1}
+
+class StageStats:
+    """Throughput and backpressure counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.processed = 0
+        self.busy_time = 0.0        # Time spent doing the stage's work
+        self.starved_time = 0.0     # Time spent waiting for input from upstream
+        self.blocked_time = 0.0     # Time spent waiting for room in the downstream queue (backpressure)
+        self.max_queue_depth = 0    # Deepest input queue seen by this stage
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'busy_s': self.busy_time,
+            'starved_s': self.starved_time,
+            'blocked_s': self.blocked_time,
+            'max_queue_depth': self.max_queue_depth,
+        }
+
+class ReorderBuffer:
+    """Releases the items finished by a stage's workers downstream in tick order."""
+
+    def __init__(self, put):
+        self.put = put
+        self.pending = {}  # tick -> item finished ahead of an earlier tick
+        self.next_tick = 0
+        self.lock = asyncio.Lock()
+
+    async def release(self, item):
+        self.pending[item['tick']] = item
+        # Whoever holds the lock drains every consecutive tick, including ones added while it waits on put
+        async with self.lock:
+            while self.next_tick in self.pending:
+                await self.put(self.pending.pop(self.next_tick))
+                self.next_tick += 1
+
+class AsyncPipeline:
+    """Runs simulate -> detect -> analyze -> persist -> publish as concurrent asyncio stages."""
+
+    def __init__(self, can_sim, n_vehicles=1, queue_size=8, concurrency=None, stage_timer=None):
+        self.can_sim = can_sim
+        self.n_vehicles = n_vehicles
+        self.queue_size = queue_size
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        for name in STATEFUL_STAGES:
+            if self.concurrency[name] != 1:
+                raise ValueError(f"The {name} stage is stateful and runs with exactly one worker")
+        self.stage_timer = stage_timer or StageTimer()
+        self.stats = {name: StageStats(name) for name in ['simulate'] + STAGES}
+        self.completed = 0
+
+        # Blocking work (sklearn, sqlite, torch, CAN) runs on this pool instead of the event loop
+        self.executor = ThreadPoolExecutor(max_workers=sum(self.concurrency.values()),
+                                           thread_name_prefix='pipeline')
+
+    # Stage bodies; each takes and returns the per-tick item dictionary
+
+    def _detect(self, item):
+        item['vehicle_flags'], item['anomaly_flags'] = simulation.detect_stage(item['sensor_batch'])
+        return item
+
+    def _analyze(self, item):
+        item['mean_vector'], item['threat_probability'] = simulation.predict_stage(item['sensor_batch'])
+        item['action'], item['response_time'] = simulation.respond_stage(item['mean_vector'], item['anomaly_flags'])
+        return item
+
+    def _persist(self, item):
+        simulation.persist_stage(item['sensor_batch'])
+        return item
+
+    def _publish(self, item):
+        simulation.publish_stage(self.can_sim, item['sensor_batch'], item['vehicle_flags'])
+        return item
+
+    def _timed(self, name, fn, item):
+        start = time.perf_counter()
+        try:
+            return fn(item)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_timer.record(name, elapsed)
+            self.stats[name].busy_time += elapsed
+
+    async def _put(self, name, queue, item):
+        start = time.perf_counter()
+        await queue.put(item)
+        self.stats[name].blocked_time += time.perf_counter() - start
+
+    async def _source(self, out_queue, ticks, tick_interval):
+        stats = self.stats['simulate']
+        tick = 0
+        while ticks is None or tick < ticks:
+            start = time.perf_counter()
+            sensor_batch = simulation.simulate_sensor_batch(self.n_vehicles)
+            elapsed = time.perf_counter() - start
+            self.stage_timer.record('simulate', elapsed)
+            stats.busy_time += elapsed
+            stats.processed += 1
+
+            await self._put('simulate', out_queue, {'tick': tick, 'start': start, 'sensor_batch': sensor_batch})
+            tick += 1
+            if tick_interval:
+                await asyncio.sleep(tick_interval)
+        await out_queue.put(_END)
+
+    async def _worker(self, name, fn, in_queue, emit):
+        loop = asyncio.get_running_loop()
+        stats = self.stats[name]
+        while True:
+            stats.max_queue_depth = max(stats.max_queue_depth, in_queue.qsize())
+            start = time.perf_counter()
+            item = await in_queue.get()
+            stats.starved_time += time.perf_counter() - start
+            if item is _END:
+                # Hand the marker back so sibling workers of this stage stop as well
+                await in_queue.put(_END)
+                return
+            item = await loop.run_in_executor(self.executor, self._timed, name, fn, item)
+            stats.processed += 1
+            await emit(item)
+
+    async def _stage(self, name, fn, in_queue, out_queue):
+        async def put(item):
+            await self._put(name, out_queue, item)
+
+        # Several workers can finish ticks out of order, so their output goes through a reorder buffer
+        emit = ReorderBuffer(put).release if self.concurrency[name] > 1 else put
+        workers = [self._worker(name, fn, in_queue, emit) for _ in range(self.concurrency[name])]
+        await asyncio.gather(*workers)
+        await out_queue.put(_END)
+
+    async def _sink(self, in_queue):
+        while True:
+            item = await in_queue.get()
+            if item is _END:
+                return
+            detection_time = time.perf_counter() - item['start']
+            self.stage_timer.record('tick', detection_time)
+            anomaly = 1.0 if any(item['anomaly_flags'].values()) else 0.0
+            simulation.performance_metrics.update_detection_metrics([detection_time, item['response_time'], anomaly])
+            self.completed += 1
+
+    async def run(self, ticks=None, tick_interval=0.0):
+        """Run the pipeline for `ticks` ticks (forever when None) and return the stage statistics."""
+        fns = {'detect': self._detect, 'analyze': self._analyze, 'persist': self._persist, 'publish': self._publish}
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(len(STAGES) + 1)]
+
+        tasks = [self._source(queues[0], ticks, tick_interval)]
+        for i, name in enumerate(STAGES):
+            tasks.append(self._stage(name, fns[name], queues[i], queues[i + 1]))
+        tasks.append(self._sink(queues[-1]))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.executor.shutdown(wait=True)
+        return self.report()
+
+    def report(self):
+        return {
+            'completed': self.completed,
+            'concurrency': self.concurrency,
+            'stages': {name: stats.as_dict() for name, stats in self.stats.items()},
+            'latency': self.stage_timer.summary(),
+        }
+
+def run_pipeline(ticks=1000, n_vehicles=1, queue_size=8, concurrency=None):
+    """Run the asyncio pipeline headless for a fixed number of ticks and return its report."""
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Fit the anomaly model up front so the first tick does not pay for it
+    simulation.detect_stage(simulation.simulate_sensor_batch(1))
+
+    can_sim = CANSimulation()
+    can_sim.start()
+    pipeline = AsyncPipeline(can_sim, n_vehicles, queue_size, concurrency)
+    try:
+        start = time.perf_counter()
+        report = asyncio.run(pipeline.run(ticks))
+        elapsed = time.perf_counter() - start
+    finally:
+        can_sim.stop()
+        simulation.sensor_writer.stop()
+        simulation.performance_metrics.rollup.stop()
+
+    report['elapsed_s'] = elapsed
+    report['ticks_per_sec'] = report['completed'] / elapsed if elapsed > 0 else float('inf')
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Asyncio staged simulation pipeline")
+    parser.add_argument('--ticks', type=int, default=1000, help="Number of ticks to push through the pipeline")
+    parser.add_argument('--vehicles', type=int, default=1, help="Number of vehicles simulated per tick")
+    parser.add_argument('--queue-size', type=int, default=8, help="Capacity of each inter-stage queue")
+    for name in STAGES:
+        parser.add_argument(f'--{name}-workers', type=int, default=DEFAULT_CONCURRENCY[name],
+                            help=f"Concurrent workers for the {name} stage"
+                                 + (" (stateful, must be 1)" if name in STATEFUL_STAGES else ""))
+    args = parser.parse_args()
+
+    concurrency = {name: getattr(args, f'{name}_workers') for name in STAGES}
+    for name in STATEFUL_STAGES:
+        if concurrency[name] != 1:
+            parser.error(f"--{name}-workers must be 1: the {name} stage is stateful")
+    report = run_pipeline(args.ticks, args.vehicles, args.queue_size, concurrency)
+
+    # Print the pipeline report
+    print(f"{report['completed']} ticks in {report['elapsed_s']:.2f} s ({report['ticks_per_sec']:.1f} ticks/sec)")
+    for name, stats in report['stages'].items():
+        print(f"{name:10s} processed={stats['processed']} busy={stats['busy_s']:.3f}s "
+              f"starved={stats['starved_s']:.3f}s blocked={stats['blocked_s']:.3f}s "
+              f"max_queue_depth={stats['max_queue_depth']}")
@@ -4,8 +4,11 @@ import plotly.graph_objects as go
 import sqlite3
 import pandas as pd
 from performance_metrics import PerformanceMetrics
+import sensor_store
+import sensor_rollup
 import logging
 import os
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -46,30 +49,15 @@ metrics_db_path = os.path.join(script_dir, 'metrics_db.sqlite')
 
 def fetch_data_from_db():
     try:
-        conn = sqlite3.connect(racing_db_path)
-        cursor = conn.cursor()
+        # Both panes show the same window; timestamps are stored in local time, so the bounds are too
+        end = time.time()
         
-        # Fetch sensor data
-        query = """
-        SELECT timestamp, sensor, value
-        FROM sensor_data
-        WHERE timestamp >= datetime('now', '-5 minutes')
-        ORDER BY timestamp ASC
-        """
-        cursor.execute(query)
-        sensor_data = cursor.fetchall()
+        # Fetch sensor data at the resolution that fits the window (raw rows for short windows)
+        sensor_data = sensor_rollup.fetch_sensor_window(5, db_path=racing_db_path, end=end)
         
         # Fetch anomaly data
-        query = """
-        SELECT timestamp, sensor, value
-        FROM anomalies
-        WHERE timestamp >= datetime('now', '-5 minutes')
-        ORDER BY timestamp ASC
-        """
-        cursor.execute(query)
-        anomaly_data = cursor.fetchall()
-        
-        conn.close()
+        anomaly_data = sensor_store.fetch_anomaly_range(sensor_rollup.to_timestamp(end - 5 * 60),
+                                                        sensor_rollup.to_timestamp(end), racing_db_path)
         
         logging.debug(f"Fetched sensor data: {sensor_data}")
         logging.debug(f"Fetched anomaly data: {anomaly_data}")
@@ -82,20 +70,8 @@ def fetch_data_from_db():
 
 def fetch_performance_metrics_from_db():
     try:
-        conn = sqlite3.connect(metrics_db_path)
-        cursor = conn.cursor()
-        
         # Fetch performance metrics
-        query = """
-        SELECT timestamp, detection_time, response_time, threat_detection_rate
-        FROM performance_metrics
-        WHERE timestamp >= datetime('now', '-5 minutes')
-        ORDER BY timestamp ASC
-        """
-        cursor.execute(query)
-        performance_data = cursor.fetchall()
-        
-        conn.close()
+        performance_data = sensor_store.fetch_performance_window(5, metrics_db_path)
         
         logging.debug(f"Fetched performance data: {performance_data}")
         
@@ -0,0 +1,106 @@
+import queue
+import threading
+import logging
+import numpy as np
+from adaptive_mechanisms import DRLAgent
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+class BackgroundLearner:
+    """Trains a private copy of the acting policy on a background thread and publishes it to the actor.
+
+    The simulation loop only calls submit(), which queues a transition without blocking. The
+    learner thread drains the queue into its own replay memory, runs minibatch updates on its own
+    network and optimizer, and every `publish_interval` steps hands the weights to the actor's
+    publish_weights(), which swaps in a new policy with a single reference assignment (a DRLAgent
+    module, a NumpyPolicy layer list). The actor never waits for training or for a publish.
+
+    Training is paced by the incoming experience: each new transition buys `replay_ratio` minibatch
+    updates, and once they are spent the thread blocks on the queue until more transitions arrive
+    instead of replaying the same memory over and over.
+    """
+
+    def __init__(self, actor, publish_interval=100, max_queue_size=10000, replay_ratio=1.0, idle_timeout=0.1,
+                 **trainer_kwargs):
+        self.actor = actor
+        self.publish_interval = publish_interval
+        self.replay_ratio = replay_ratio  # Minibatch updates per new transition
+        self.idle_timeout = idle_timeout  # Longest wait for a transition before checking for stop()
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.transitions_received = 0
+        self.transitions_dropped = 0
+        self.publishes = 0
+        self.last_loss = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # The learner trains its own network, initialised from the actor's current policy
+        self.trainer = DRLAgent(actor.state_dim, actor.action_dim, **trainer_kwargs)
+        self.trainer.load_weights(actor.policy_weights())
+
+    def start(self):
+        # Start the learner thread
+        self.thread = threading.Thread(target=self._run, name='BackgroundLearner', daemon=True)
+        self.thread.start()
+        logging.info("Background DRL learner started.")
+
+    def stop(self):
+        # Stop the learner thread and publish the latest weights
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.publish()
+        logging.info(f"Background DRL learner stopped ({self.trainer.train_steps} steps, "
+                     f"{self.transitions_received} transitions, {self.publishes} publishes, "
+                     f"{self.transitions_dropped} transitions dropped).")
+
+    def submit(self, state, action, reward, next_state, done=False):
+        """Queue one transition (or a block of transitions) for training without blocking the caller."""
+        try:
+            self.queue.put_nowait((state, action, reward, next_state, done))
+        except queue.Full:
+            self.transitions_dropped += self._rows(state)
+
+    def _rows(self, state):
+        # Number of transitions in a submitted block
+        return len(np.asarray(state).reshape(-1, self.actor.state_dim))
+
+    def publish(self):
+        self.actor.publish_weights(self.trainer.policy_weights())
+        self.publishes += 1
+
+    def _drain(self, block=False):
+        # Move every queued transition into the learner's replay memory and return how many there were;
+        # with block=True wait up to idle_timeout for the first one
+        drained = 0
+        while True:
+            try:
+                if block and not drained:
+                    transition = self.queue.get(timeout=self.idle_timeout)
+                else:
+                    transition = self.queue.get_nowait()
+            except queue.Empty:
+                self.transitions_received += drained
+                return drained
+            self.trainer.remember(*transition)
+            drained += self._rows(transition[0])
+
+    def _run(self):
+        budget = 0.0  # Minibatch updates earned by new transitions and not yet run
+        while not self.stop_event.is_set():
+            try:
+                memory = self.trainer.memory
+                idle = budget < 1 or len(memory) < memory.batch_size
+                # Block on the queue when there is nothing left to learn from, rather than spinning
+                budget += self.replay_ratio * self._drain(block=idle)
+                if budget < 1 or len(memory) < memory.batch_size:
+                    continue
+                self.last_loss = self.trainer.train_step()
+                budget -= 1
+                if self.trainer.train_steps % self.publish_interval == 0:
+                    self.publish()
+            except Exception as e:
+                logging.error(f"Error in background DRL learner: {e}")
+                self.stop_event.wait(self.idle_timeout)
@@ -0,0 +1,73 @@
+import numpy as np
+
+class ReplayBuffer:
+    """Fixed-capacity experience replay memory backed by preallocated NumPy arrays.
+
+    Transitions are written into a ring buffer, so adding never allocates and the oldest
+    transitions are overwritten once the buffer is full. sample() gathers a minibatch into
+    preallocated output arrays that can be wrapped by torch.from_numpy without a copy.
+    """
+
+    def __init__(self, capacity, state_dim, batch_size=64, seed=None):
+        self.capacity = capacity
+        self.state_dim = state_dim
+        self.batch_size = batch_size
+        self.rng = np.random.default_rng(seed)
+
+        # Preallocated transition storage
+        self.states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_dim), dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+        self.index = 0
+        self.count = 0
+
+        # Preallocated minibatch, reused by every sample() call of the same size
+        self._allocate_batch(batch_size)
+
+    def _allocate_batch(self, batch_size):
+        self.batch_size = batch_size
+        self.batch_indices = np.zeros(batch_size, dtype=np.intp)
+        self.batch_states = np.zeros((batch_size, self.state_dim), dtype=np.float32)
+        self.batch_actions = np.zeros(batch_size, dtype=np.int64)
+        self.batch_rewards = np.zeros(batch_size, dtype=np.float32)
+        self.batch_next_states = np.zeros((batch_size, self.state_dim), dtype=np.float32)
+        self.batch_dones = np.zeros(batch_size, dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, state, action, reward, next_state, done):
+        """Store one transition, or a block of n transitions given as arrays with a leading n axis."""
+        states = np.asarray(state, dtype=np.float32).reshape(-1, self.state_dim)
+        n = len(states)
+        if not n:
+            return
+
+        # Only the newest `capacity` transitions can survive
+        keep = slice(max(0, n - self.capacity), n)
+        positions = (self.index + np.arange(n)[keep]) % self.capacity
+        self.states[positions] = states[keep]
+        self.actions[positions] = np.broadcast_to(np.asarray(action, dtype=np.int64).reshape(-1), (n,))[keep]
+        self.rewards[positions] = np.broadcast_to(np.asarray(reward, dtype=np.float32).reshape(-1), (n,))[keep]
+        self.next_states[positions] = np.asarray(next_state, dtype=np.float32).reshape(-1, self.state_dim)[keep]
+        self.dones[positions] = np.broadcast_to(np.asarray(done, dtype=np.float32).reshape(-1), (n,))[keep]
+        self.index = (self.index + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def sample(self, batch_size=None):
+        """Return (states, actions, rewards, next_states, dones) for a uniform random minibatch.
+
+        The returned arrays are overwritten by the next call; copy them if they must outlive it.
+        """
+        if batch_size is not None and batch_size != self.batch_size:
+            self._allocate_batch(batch_size)
+        self.batch_indices[:] = self.rng.integers(0, self.count, size=self.batch_size)
+        np.take(self.states, self.batch_indices, axis=0, out=self.batch_states)
+        np.take(self.actions, self.batch_indices, out=self.batch_actions)
+        np.take(self.rewards, self.batch_indices, out=self.batch_rewards)
+        np.take(self.next_states, self.batch_indices, axis=0, out=self.batch_next_states)
+        np.take(self.dones, self.batch_indices, out=self.batch_dones)
+        return (self.batch_states, self.batch_actions, self.batch_rewards,
+                self.batch_next_states, self.batch_dones)
@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import re
+import time
+import logging
+from array import array
+import numpy as np
+import sensor_store
+from sensor_rollup import to_epoch
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Aged sensor_data rows live here, one directory per sensor. Each (local) day of a sensor is stored as
+# one or more chunks, each a pair of .npy files: <day>.<n>.ts.npy holds int64 epoch nanoseconds and
+# <day>.<n>.values.npy float32 values, both in insertion order. Days are archived whole, so a day
+# normally has a single chunk; rows that turn up later for an archived day add a chunk rather than
+# rewriting the existing ones. manifest.json lists the chunks and the last archived sensor_data rowid.
+archive_dir = 'sensor_archive'
+MANIFEST = 'manifest.json'
+
+def _empty_manifest():
+    return {'version': 2, 'archived_rowid': 0, 'last_ns': 0, 'pending_delete': False, 'segments': {}}
+
+def load_manifest(archive_dir=archive_dir):
+    try:
+        with open(os.path.join(archive_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return _empty_manifest()
+
+def save_manifest(manifest, archive_dir=archive_dir):
+    # Write to a temp file and swap it in, so readers never see a partial manifest
+    path = os.path.join(archive_dir, MANIFEST)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def _save_array(path, values):
+    tmp_path = f'{path}.tmp.npy'
+    np.save(tmp_path, values)
+    os.replace(tmp_path, path)
+
+def _add_chunk(manifest, sensor, day, timestamps, values, archive_dir):
+    """Write one new chunk of a day segment; existing chunks are never rewritten."""
+    entry = manifest['segments'].setdefault(sensor, {}).setdefault(day, {'chunks': [], 'rows': 0})
+    folder = re.sub(r'[^A-Za-z0-9_.-]', '_', sensor)
+    os.makedirs(os.path.join(archive_dir, folder), exist_ok=True)
+    name = f'{folder}/{day}.{len(entry["chunks"])}'
+    _save_array(os.path.join(archive_dir, f'{name}.ts.npy'), timestamps)
+    _save_array(os.path.join(archive_dir, f'{name}.values.npy'), values)
+    entry['chunks'].append({'timestamps': f'{name}.ts.npy', 'values': f'{name}.values.npy', 'rows': len(values)})
+    entry['rows'] += len(values)
+    entry['start_ns'] = min(entry.get('start_ns', int(timestamps.min())), int(timestamps.min()))
+    entry['end_ns'] = max(entry.get('end_ns', int(timestamps.max())), int(timestamps.max()))
+
+def _to_ns(timestamp):
+    return int(round(timestamp * 1e9)) if isinstance(timestamp, float) else to_epoch(timestamp) * 10 ** 9
+
+def _day_start(epoch):
+    """Epoch of local midnight on the day of `epoch`."""
+    t = time.localtime(epoch)
+    return int(time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1)))
+
+def _recover(conn, manifest, db_path, page_size):
+    """Finish a delete interrupted after its chunks were written, and notice sensor_data rowids being reused.
+
+    Returns True when the manifest changed.
+    """
+    changed = False
+    mark = manifest['archived_rowid']
+    if manifest['pending_delete']:
+        # Only rows that are already archived: at or before the last archived timestamp. Rows without
+        # a timestamp are kept, at worst archiving them twice rather than losing them.
+        stale = []
+        after = 0
+        while after < mark:
+            rows = sensor_store.fetch_sensor_rows_since(after, page_size, db_path)
+            if not rows:
+                break
+            stale.extend((rowid,) for rowid, _, _, timestamp in rows
+                         if rowid <= mark and timestamp is not None and _to_ns(timestamp) <= manifest['last_ns'])
+            after = rows[-1][0]
+        with conn:
+            conn.executemany('DELETE FROM sensor_data WHERE rowid = ?', stale)
+        manifest['pending_delete'] = False
+        changed = True
+
+    # Everything up to the mark has been deleted, so any row at or below it is new: sensor_data has no
+    # AUTOINCREMENT and SQLite starts again from rowid 1 if something else (e.g. a manual cleanup) empties it
+    if mark and conn.execute('SELECT 1 FROM sensor_data WHERE rowid <= ? LIMIT 1', (mark,)).fetchone():
+        logging.warning("sensor_data rowids were reused; archiving again from the first row.")
+        manifest['archived_rowid'] = 0
+        changed = True
+    return changed
+
+def archive_aged(max_age=7 * 24 * 3600, db_path=sensor_store.racing_db_path, archive_dir=archive_dir,
+                 page_size=100000, now=None):
+    """Move sensor_data rows from days entirely older than `max_age` seconds into the archive; returns the number moved.
+
+    Rows are taken in rowid (insertion) order up to the first one from a day that is not old
+    enough, so each day is written once and rows stay in sensor_data for up to a day longer than
+    `max_age`. The newest row always stays: sensor_data has no AUTOINCREMENT, so emptying it would
+    let SQLite hand out rowids again from 1 and rowid high-water marks would skip the new rows. The chunks and manifest are written before the rows are deleted; a run interrupted
+    in between finishes the delete on the next call. Rows without a timestamp get the previous
+    row's; rows without a sensor or value are dropped.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    manifest = load_manifest(archive_dir)
+    conn = sensor_store.connect(db_path)
+    if _recover(conn, manifest, db_path, page_size):
+        save_manifest(manifest, archive_dir)
+
+    cutoff_ns = _day_start((time.time() if now is None else now) - max_age) * 10 ** 9
+    max_rowid = sensor_store.fetch_max_sensor_rowid(db_path) or 0
+    last_ns = manifest['last_ns']
+    last_rowid = manifest['archived_rowid']
+    epochs = {}  # timestamp -> (epoch ns, local day)
+    pending = {}  # (sensor, day) -> (array of ns, array of values)
+    moved = 0
+    limit = 1  # Most calls find nothing old enough, so look at the oldest row before reading whole pages
+    done = False
+    while not done:
+        rows = sensor_store.fetch_sensor_rows_since(last_rowid, limit, db_path)
+        for rowid, sensor, value, timestamp in rows:
+            if rowid >= max_rowid:
+                done = True
+                break
+            if timestamp is not None:
+                if timestamp not in epochs:
+                    if len(epochs) > 4096:
+                        epochs.clear()
+                    ts_ns = _to_ns(timestamp)
+                    epochs[timestamp] = (ts_ns, time.strftime('%Y-%m-%d', time.localtime(ts_ns // 10 ** 9)))
+                ts_ns, _ = epochs[timestamp]
+                if ts_ns >= cutoff_ns:
+                    done = True
+                    break
+                last_ns = ts_ns
+            last_rowid = rowid
+            if sensor is None or value is None:
+                continue
+            day = time.strftime('%Y-%m-%d', time.localtime(last_ns // 10 ** 9)) if timestamp is None else epochs[timestamp][1]
+            timestamps, values = pending.setdefault((sensor, day), (array('q'), array('f')))
+            timestamps.append(last_ns)
+            values.append(value)
+            moved += 1
+        if len(rows) < limit:
+            done = True
+        limit = page_size
+
+    if last_rowid == manifest['archived_rowid']:
+        return 0
+    for (sensor, day), (timestamps, values) in sorted(pending.items()):
+        _add_chunk(manifest, sensor, day, np.frombuffer(timestamps, dtype=np.int64),
+                   np.frombuffer(values, dtype=np.float32), archive_dir)
+    manifest.update(archived_rowid=last_rowid, last_ns=last_ns, pending_delete=True)
+    save_manifest(manifest, archive_dir)
+    with conn:
+        conn.execute('DELETE FROM sensor_data WHERE rowid <= ?', (last_rowid,))
+    manifest['pending_delete'] = False
+    save_manifest(manifest, archive_dir)
+    logging.info(f"Archived {moved} sensor_data rows into {len(pending)} chunks.")
+    return moved
+
+def load_segment(sensor, day, archive_dir=archive_dir, manifest=None):
+    """[(timestamps, values)] of one day segment, one read-only np.memmap pair per chunk, oldest first."""
+    entry = (manifest or load_manifest(archive_dir))['segments'][sensor][day]
+    return [(np.load(os.path.join(archive_dir, chunk['timestamps']), mmap_mode='r'),
+             np.load(os.path.join(archive_dir, chunk['values']), mmap_mode='r')) for chunk in entry['chunks']]
+
+def iter_segments(sensor=None, start_day=None, end_day=None, archive_dir=archive_dir):
+    """Yield (sensor, day, timestamps, values) memmap views, chunk by chunk, for one or every sensor.
+
+    start_day and end_day ('YYYY-MM-DD') are inclusive bounds.
+    """
+    manifest = load_manifest(archive_dir)
+    names = [sensor] if sensor is not None else sorted(manifest['segments'])
+    for name in names:
+        for day in sorted(manifest['segments'].get(name, {})):
+            if (start_day is None or day >= start_day) and (end_day is None or day <= end_day):
+                for timestamps, values in load_segment(name, day, archive_dir, manifest):
+                    yield name, day, timestamps, values
+
+def sensor_history(sensor, limit=1000, archive_dir=archive_dir):
+    """Latest `limit` archived values of one sensor, newest first."""
+    chunks = []
+    remaining = limit
+    for _, _, _, values in reversed(list(iter_segments(sensor, archive_dir=archive_dir))):
+        if remaining <= 0:
+            break
+        chunks.append(values[::-1][:remaining])
+        remaining -= len(chunks[-1])
+    return np.concatenate(chunks).astype(float) if chunks else np.array([], dtype=float)
+
+def value_change_counts(archive_dir=archive_dir):
+    """{sensor: (changes, comparisons, last value)} over the archived values, as calculate_detection_rate counts them.
+
+    Every archived value counts, including rows that were archived without a timestamp.
+    """
+    counts = {}
+    for sensor, _, _, values in iter_segments(archive_dir=archive_dir):
+        if not len(values):
+            continue
+        changes, comparisons, last = counts.get(sensor, (0, 0, None))
+        if last is not None:
+            changes += int(values[0] != last)
+            comparisons += 1
+        changes += int(np.count_nonzero(values[1:] != values[:-1]))
+        comparisons += len(values) - 1
+        counts[sensor] = (changes, comparisons, float(values[-1]))
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive aged sensor_data rows into memory-mapped .npy segments")
+    parser.add_argument('--db', default=sensor_store.racing_db_path, help="Racing database path")
+    parser.add_argument('--archive-dir', default=archive_dir, help="Archive directory")
+    parser.add_argument('--max-age-days', type=float, help="Archive rows older than this many days")
+    args = parser.parse_args()
+
+    if args.max_age_days is not None:
+        start = time.perf_counter()
+        moved = archive_aged(args.max_age_days * 24 * 3600, args.db, args.archive_dir)
+        print(f"Archived {moved} rows in {time.perf_counter() - start:.2f} s")
+
+    # Scan the whole archive to report per-sensor statistics and the scan throughput
+    start = time.perf_counter()
+    totals = {}
+    for sensor, _, _, values in iter_segments(archive_dir=args.archive_dir):
+        count, total, nbytes = totals.get(sensor, (0, 0.0, 0))
+        totals[sensor] = (count + len(values), total + float(values.sum(dtype=np.float64)), nbytes + values.nbytes)
+    elapsed = time.perf_counter() - start
+    for sensor, (count, total, _) in totals.items():
+        print(f"{sensor:15s} {count:10d} values  mean={total / count:.3f}")
+    nbytes = sum(nbytes for _, _, nbytes in totals.values())
+    print(f"Scanned {nbytes / 1e6:.1f} MB in {elapsed * 1e3:.1f} ms")
@@ -0,0 +1,211 @@
+import argparse
+import time
+import logging
+import sensor_store
+from sensor_store import ROLLUP_TABLES
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Format of the (local time) timestamps stored in sensor_data
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Retention in seconds per resolution; 'raw' is sensor_data itself and None keeps rows forever.
+# Raw rows are kept by default; pass e.g. {'raw': 6 * 3600} to SensorRollup to delete them.
+DEFAULT_RETENTION = {'raw': None, 1: 2 * 24 * 3600, 10: 30 * 24 * 3600, 60: None}
+
+# Resolutions from finest to coarsest; raw rows have the 1-second resolution of their timestamps
+RESOLUTIONS = ['raw'] + sorted(ROLLUP_TABLES)
+
+def upsert_sql(table):
+    # Merge a partial bucket into an existing one; rows arrive in time order, so the newest last value wins
+    return f'''INSERT INTO {table} (bucket, sensor, value_count, value_sum, value_min, value_max, value_last)
+               VALUES (?, ?, ?, ?, ?, ?, ?)
+               ON CONFLICT (bucket, sensor) DO UPDATE SET
+                   value_count = value_count + excluded.value_count,
+                   value_sum = value_sum + excluded.value_sum,
+                   value_min = MIN(value_min, excluded.value_min),
+                   value_max = MAX(value_max, excluded.value_max),
+                   value_last = excluded.value_last'''
+
+def to_epoch(timestamp):
+    """Epoch seconds of a sensor_data timestamp string (local time), or of a numeric timestamp."""
+    if isinstance(timestamp, (int, float)):
+        return int(timestamp)
+    return int(time.mktime(time.strptime(timestamp, TIMESTAMP_FORMAT)))
+
+def to_timestamp(epoch):
+    """sensor_data timestamp string (local time) for epoch seconds."""
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(epoch))
+
+class SensorRollup:
+    """Keeps 1 s / 10 s / 1 min min/max/mean/last rollups of sensor_data and applies retention.
+
+    apply() is called by SensorDataWriter with every batch it inserts, on the same connection and
+    inside the same transaction, so the rollups never lag the raw rows. A batch is aggregated in
+    memory first and each rollup table receives at most one upsert per (bucket, sensor).
+    """
+
+    def __init__(self, retention=None):
+        self.retention = {**DEFAULT_RETENTION, **(retention or {})}
+        self._epochs = {}  # timestamp string -> epoch seconds; a batch only spans a few distinct seconds
+
+    def _epoch(self, timestamp):
+        epoch = self._epochs.get(timestamp)
+        if epoch is None:
+            if len(self._epochs) > 4096:
+                self._epochs.clear()
+            epoch = self._epochs[timestamp] = to_epoch(timestamp)
+        return epoch
+
+    def aggregate(self, rows):
+        """{resolution: {(bucket, sensor): [count, sum, min, max, last]}} for (timestamp, sensor, value) rows."""
+        finest = {}
+        unparseable = 0
+        for timestamp, sensor, value in rows:
+            if timestamp is None or sensor is None or value is None:
+                continue
+            try:
+                key = (self._epoch(timestamp), sensor)
+            except (TypeError, ValueError):
+                # Rows in another timestamp format are skipped like rows without one
+                unparseable += 1
+                continue
+            bucket = finest.get(key)
+            if bucket is None:
+                finest[key] = [1, value, value, value, value]
+            else:
+                bucket[0] += 1
+                bucket[1] += value
+                bucket[2] = min(bucket[2], value)
+                bucket[3] = max(bucket[3], value)
+                bucket[4] = value
+        if unparseable:
+            logging.warning(f"Skipped {unparseable} sensor_data rows with unparseable timestamps in the rollups.")
+
+        # Coarser resolutions are built from the 1-second buckets, which are in arrival order
+        aggregates = {}
+        for resolution in sorted(ROLLUP_TABLES):
+            coarse = {}
+            for (second, sensor), (count, total, low, high, last) in finest.items():
+                key = (second // resolution * resolution, sensor)
+                bucket = coarse.get(key)
+                if bucket is None:
+                    coarse[key] = [count, total, low, high, last]
+                else:
+                    bucket[0] += count
+                    bucket[1] += total
+                    bucket[2] = min(bucket[2], low)
+                    bucket[3] = max(bucket[3], high)
+                    bucket[4] = last
+            aggregates[resolution] = coarse
+        return aggregates
+
+    def apply(self, conn, rows):
+        """Fold (timestamp, sensor, value) rows into every rollup table; the caller commits."""
+        for resolution, buckets in self.aggregate(rows).items():
+            conn.executemany(upsert_sql(ROLLUP_TABLES[resolution]),
+                             [key + tuple(bucket) for key, bucket in buckets.items()])
+
+    def apply_retention(self, conn, now=None, min_raw_age=None):
+        """Delete raw rows and rollup buckets older than their retention; returns {resolution: rows deleted}.
+
+        Raw rows younger than `min_raw_age` seconds are kept whatever the raw retention says, and so is
+        the newest raw row, so sensor_data is never emptied and its rowids keep increasing.
+        """
+        now = time.time() if now is None else now
+        deleted = {}
+        with conn:
+            if self.retention.get('raw') is not None:
+                raw_age = max(self.retention['raw'], min_raw_age or 0)
+                cursor = conn.execute('''DELETE FROM sensor_data WHERE timestamp < ?
+                                         AND rowid < (SELECT MAX(rowid) FROM sensor_data)''',
+                                      (to_timestamp(now - raw_age),))
+                deleted['raw'] = cursor.rowcount
+            for resolution, table in ROLLUP_TABLES.items():
+                if self.retention.get(resolution) is not None:
+                    cursor = conn.execute(f'DELETE FROM {table} WHERE bucket < ?',
+                                          (int(now - self.retention[resolution]),))
+                    deleted[resolution] = cursor.rowcount
+        return deleted
+
+    def ensure_backfilled(self, conn):
+        """Backfill once when the rollup tables are empty but sensor_data is not, e.g. right after the migration."""
+        if any(conn.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() for table in ROLLUP_TABLES.values()):
+            return
+        if conn.execute('SELECT 1 FROM sensor_data LIMIT 1').fetchone():
+            start = time.perf_counter()
+            self.backfill(conn)
+            logging.info(f"Backfilled sensor_data rollups in {time.perf_counter() - start:.2f} s.")
+
+    def backfill(self, conn, page_size=50000):
+        """Rebuild every rollup table from the raw rows currently in sensor_data."""
+        with conn:
+            for table in ROLLUP_TABLES.values():
+                conn.execute(f'DELETE FROM {table}')
+            cursor = conn.execute('SELECT timestamp, sensor, value FROM sensor_data ORDER BY rowid')
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                self.apply(conn, rows)
+
+def choose_resolution(start, end, max_points=2000, retention=None, now=None):
+    """Finest resolution whose buckets cover [start, end) in at most `max_points` points per sensor.
+
+    Resolutions whose retention no longer reaches back to `start` are skipped; when nothing fits
+    the coarsest resolution is used.
+    """
+    retention = {**DEFAULT_RETENTION, **(retention or {})}
+    now = time.time() if now is None else now
+    for resolution in RESOLUTIONS:
+        seconds = 1 if resolution == 'raw' else resolution
+        kept = retention.get(resolution)
+        if kept is not None and start < now - kept:
+            continue
+        if (end - start) / seconds <= max_points:
+            return resolution
+    return RESOLUTIONS[-1]
+
+def fetch_sensor_series(start, end=None, sensor=None, max_points=2000, retention=None,
+                        db_path=sensor_store.racing_db_path):
+    """Return (resolution, rows) for epoch range [start, end) at the resolution choose_resolution() picks.
+
+    Rows are (bucket epoch, sensor, mean, min, max, last, count), oldest first; raw rows report
+    their value as mean, min, max and last with a count of 1.
+    """
+    end = time.time() if end is None else end
+    resolution = choose_resolution(start, end, max_points, retention)
+    if resolution == 'raw':
+        rows = [(to_epoch(timestamp), name, value, value, value, value, 1)
+                for timestamp, name, value in sensor_store.fetch_sensor_range(to_timestamp(start), to_timestamp(end), db_path)]
+    else:
+        rows = sensor_store.fetch_rollup_range(resolution, int(start), int(end), db_path)
+    if sensor is not None:
+        rows = [row for row in rows if row[1] == sensor]
+    return resolution, rows
+
+def fetch_sensor_window(minutes=5, max_points=2000, db_path=sensor_store.racing_db_path, end=None):
+    """Drop-in for sensor_store.fetch_sensor_window: (timestamp, sensor, mean value) rows of the `minutes` minutes before `end` (now)."""
+    end = time.time() if end is None else end
+    _, rows = fetch_sensor_series(end - minutes * 60, end, max_points=max_points, db_path=db_path)
+    return [(to_timestamp(bucket), name, mean) for bucket, name, mean, *_ in rows]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the sensor_data rollup tables")
+    parser.add_argument('--db', default=sensor_store.racing_db_path, help="Racing database path")
+    parser.add_argument('--backfill', action='store_true', help="Rebuild the rollup tables from sensor_data")
+    parser.add_argument('--retention', action='store_true', help="Apply the retention policy now")
+    parser.add_argument('--raw-retention-hours', type=float, help="Delete raw sensor_data rows older than this")
+    args = parser.parse_args()
+
+    rollup = SensorRollup({'raw': args.raw_retention_hours * 3600} if args.raw_retention_hours else None)
+    conn = sensor_store.connect(args.db)
+    if args.backfill:
+        start = time.perf_counter()
+        rollup.backfill(conn)
+        print(f"Rebuilt rollup tables in {time.perf_counter() - start:.2f} s")
+    if args.retention:
+        print(f"Deleted rows: {rollup.apply_retention(conn)}")
+    for resolution, table in ROLLUP_TABLES.items():
+        print(f"{table}: {conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]} rows")
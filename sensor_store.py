@@ -0,0 +1,310 @@
+import sqlite3
+import threading
+import logging
+import db_pool
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Default database locations, relative to the working directory like the rest of the scripts
+racing_db_path = 'racing_vehicle_db.sqlite'
+metrics_db_path = 'metrics_db.sqlite'
+wide_db_path = 'racing_vehicle_wide.sqlite'
+
+# Schema version stored in PRAGMA user_version once the migrations below have been applied
+SCHEMA_VERSION = 3
+
+# Tables created if missing, so the indexes can always be built; definitions match the existing databases
+RACING_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS sensor_data
+       (timestamp REAL, sensor TEXT, value REAL)''',
+    '''CREATE TABLE IF NOT EXISTS anomalies
+       (timestamp REAL, sensor TEXT, value REAL, detection_time REAL)''',
+]
+
+# Downsampled sensor_data maintained by sensor_rollup.SensorRollup: resolution in seconds -> table.
+# bucket is the epoch second the bucket starts at; the mean is value_sum / value_count.
+ROLLUP_TABLES = {1: 'sensor_rollup_1s', 10: 'sensor_rollup_10s', 60: 'sensor_rollup_1m'}
+RACING_TABLES += [
+    f'''CREATE TABLE IF NOT EXISTS {table}
+        (bucket INTEGER, sensor TEXT, value_count INTEGER, value_sum REAL, value_min REAL, value_max REAL,
+         value_last REAL, PRIMARY KEY (bucket, sensor)) WITHOUT ROWID'''
+    for table in ROLLUP_TABLES.values()
+]
+
+# Covering indexes: every query below is answered from the index alone, already in ORDER BY order
+RACING_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_sensor_data_timestamp ON sensor_data (timestamp, sensor, value)',
+    'CREATE INDEX IF NOT EXISTS idx_sensor_data_sensor_timestamp ON sensor_data (sensor, timestamp, value)',
+    'CREATE INDEX IF NOT EXISTS idx_anomalies_timestamp ON anomalies (timestamp, sensor, value)',
+]
+
+# Per-second summaries written by metrics_rollup.MetricsRollup; latencies are in seconds
+METRICS_TABLES = [
+    '''CREATE TABLE IF NOT EXISTS performance_rollup_1s
+       (bucket_start INTEGER, timestamp DATETIME, tick_count INTEGER, anomaly_count REAL,
+        detection_mean REAL, detection_min REAL, detection_max REAL,
+        detection_p50 REAL, detection_p90 REAL, detection_p99 REAL,
+        response_mean REAL, response_min REAL, response_max REAL,
+        response_p50 REAL, response_p90 REAL, response_p99 REAL)''',
+    'CREATE INDEX IF NOT EXISTS idx_performance_rollup_1s_timestamp ON performance_rollup_1s (timestamp)',
+]
+
+# Compact alternative to sensor_data maintained by wide_store: one row per tick keyed by its epoch in
+# integer nanoseconds, with the tick's readings packed as little-endian float32 in `sensors` id order
+WIDE_TABLES = [
+    'CREATE TABLE IF NOT EXISTS sensors (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)',
+    'CREATE TABLE IF NOT EXISTS sensor_ticks (ts_ns INTEGER PRIMARY KEY, readings BLOB NOT NULL)',
+]
+
+METRICS_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS idx_performance_metrics_timestamp
+       ON performance_metrics (timestamp, detection_time, response_time, threat_detection_rate)''',
+]
+
+# Every read query used by the dashboard, detector and metrics, with sample parameters for EXPLAIN
+QUERIES = {
+    'recent_values': (
+        'racing',
+        "SELECT value FROM sensor_data ORDER BY timestamp DESC LIMIT ?",
+        (1000,)),
+    'sensor_history': (
+        'racing',
+        "SELECT value FROM sensor_data WHERE sensor = ? ORDER BY timestamp DESC LIMIT ?",
+        ('Speed', 1000)),
+    'latest_rows': (
+        'racing',
+        "SELECT sensor, value FROM sensor_data ORDER BY timestamp DESC LIMIT ?",
+        (8,)),
+    'sensor_rows_since': (
+        'racing',
+        "SELECT rowid, sensor, value, timestamp FROM sensor_data WHERE rowid > ? ORDER BY rowid LIMIT ?",
+        (0, 10000)),
+    'max_sensor_rowid': (
+        'racing',
+        "SELECT MAX(rowid) FROM sensor_data",
+        ()),
+    'sensor_data_with_timestamps': (
+        'racing',
+        "SELECT sensor, value, timestamp FROM sensor_data ORDER BY timestamp",
+        ()),
+    'sensor_range': (
+        'racing',
+        "SELECT timestamp, sensor, value FROM sensor_data WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp ASC",
+        ('2024-01-01 00:00:00', '2024-01-01 00:05:00')),
+    **{f'rollup_range_{resolution}': (
+        'racing',
+        f"""SELECT bucket, sensor, value_sum / value_count, value_min, value_max, value_last, value_count
+            FROM {table} WHERE bucket >= ? AND bucket < ? ORDER BY bucket ASC""",
+        (0, 300)) for resolution, table in ROLLUP_TABLES.items()},
+    'sensor_window': (
+        'racing',
+        "SELECT timestamp, sensor, value FROM sensor_data WHERE timestamp >= datetime('now', ?) ORDER BY timestamp ASC",
+        ('-5 minutes',)),
+    'wide_ticks_before': (
+        'wide',
+        "SELECT ts_ns, readings FROM sensor_ticks WHERE ts_ns < ? ORDER BY ts_ns DESC LIMIT ?",
+        (2 ** 63 - 1, 1000)),
+    'wide_ticks_since': (
+        'wide',
+        "SELECT ts_ns, readings FROM sensor_ticks WHERE ts_ns > ? ORDER BY ts_ns LIMIT ?",
+        (0, 1250)),
+    'wide_tick_range': (
+        'wide',
+        "SELECT ts_ns, readings FROM sensor_ticks WHERE ts_ns >= ? AND ts_ns < ? ORDER BY ts_ns",
+        (0, 300 * 10 ** 9)),
+    'anomaly_window': (
+        'racing',
+        "SELECT timestamp, sensor, value FROM anomalies WHERE timestamp >= datetime('now', ?) ORDER BY timestamp ASC",
+        ('-5 minutes',)),
+    'anomaly_range': (
+        'racing',
+        "SELECT timestamp, sensor, value FROM anomalies WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp ASC",
+        ('2024-01-01 00:00:00', '2024-01-01 00:05:00')),
+    'performance_window': (
+        'metrics',
+        """SELECT timestamp, detection_time, response_time, threat_detection_rate FROM performance_metrics
+           WHERE timestamp >= datetime('now', ?) ORDER BY timestamp ASC""",
+        ('-5 minutes',)),
+    'performance_rollup_window': (
+        'metrics',
+        """SELECT timestamp, tick_count, anomaly_count, detection_mean, detection_p99, response_mean, response_p99
+           FROM performance_rollup_1s WHERE timestamp >= datetime('now', ?) ORDER BY timestamp ASC""",
+        ('-5 minutes',)),
+}
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+def _table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+def migrate_schema(conn, kind='racing'):
+    """Bring a racing ('racing'), metrics ('metrics') or wide ('wide') database up to SCHEMA_VERSION."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+    if kind == 'racing':
+        for statement in RACING_TABLES + RACING_INDEXES:
+            conn.execute(statement)
+    elif kind == 'wide':
+        for statement in WIDE_TABLES:
+            conn.execute(statement)
+    else:
+        for statement in METRICS_TABLES:
+            conn.execute(statement)
+        if not _table_exists(conn, 'performance_metrics'):
+            # The performance_metrics table is created by PerformanceMetrics; finish once it exists
+            conn.commit()
+            return
+        for statement in METRICS_INDEXES:
+            conn.execute(statement)
+    conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    conn.commit()
+    logging.info(f"Migrated {kind} database schema to version {SCHEMA_VERSION}.")
+
+def connect(db_path=racing_db_path, kind='racing'):
+    """Return the pooled connection, running the schema migration the first time a database is opened."""
+    conn = db_pool.get_connection(db_path)
+    if (db_path, kind) not in _migrated:
+        with _migrate_lock:
+            if (db_path, kind) not in _migrated:
+                migrate_schema(conn, kind)
+                if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+                    _migrated.add((db_path, kind))
+    return conn
+
+def _query(name, params, db_path):
+    kind, sql, _ = QUERIES[name]
+    return connect(db_path, kind).execute(sql, params).fetchall()
+
+def fetch_recent_values(limit=1000, db_path=racing_db_path):
+    """Latest `limit` values across all sensors, newest first."""
+    return [row[0] for row in _query('recent_values', (limit,), db_path)]
+
+def fetch_sensor_history(sensor, limit=1000, db_path=racing_db_path):
+    """Latest `limit` values of one sensor, newest first."""
+    return [row[0] for row in _query('sensor_history', (sensor, limit), db_path)]
+
+def fetch_latest_rows(limit=8, db_path=racing_db_path):
+    """Latest `limit` (sensor, value) rows, newest first."""
+    return _query('latest_rows', (limit,), db_path)
+
+def iter_sensor_data_with_timestamps(page_size=10000, db_path=racing_db_path):
+    """Yield every (sensor, value, timestamp) row in timestamp order, holding at most `page_size` rows in memory."""
+    kind, sql, _ = QUERIES['sensor_data_with_timestamps']
+    cursor = connect(db_path, kind).execute(sql)
+    try:
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+def fetch_sensor_rows_since(rowid, limit=10000, db_path=racing_db_path):
+    """Up to `limit` (rowid, sensor, value, timestamp) rows inserted after `rowid`, in insertion order."""
+    return _query('sensor_rows_since', (rowid, limit), db_path)
+
+def fetch_max_sensor_rowid(db_path=racing_db_path):
+    """Highest sensor_data rowid, or None when the table is empty."""
+    return _query('max_sensor_rowid', (), db_path)[0][0]
+
+def fetch_sensor_range(start, end, db_path=racing_db_path):
+    """Raw (timestamp, sensor, value) rows with start <= timestamp < end (timestamp strings), oldest first."""
+    return _query('sensor_range', (start, end), db_path)
+
+def fetch_rollup_range(resolution, start, end, db_path=racing_db_path):
+    """(bucket, sensor, mean, min, max, last, count) rollup rows with start <= bucket < end (epoch seconds)."""
+    return _query(f'rollup_range_{resolution}', (start, end), db_path)
+
+def fetch_sensor_window(minutes=5, db_path=racing_db_path):
+    """(timestamp, sensor, value) rows from the last `minutes` minutes, oldest first."""
+    return _query('sensor_window', (f'-{minutes} minutes',), db_path)
+
+def fetch_anomaly_window(minutes=5, db_path=racing_db_path):
+    """(timestamp, sensor, value) anomaly rows from the last `minutes` minutes, oldest first."""
+    return _query('anomaly_window', (f'-{minutes} minutes',), db_path)
+
+def fetch_anomaly_range(start, end, db_path=racing_db_path):
+    """(timestamp, sensor, value) anomaly rows with start <= timestamp < end (timestamp strings), oldest first."""
+    return _query('anomaly_range', (start, end), db_path)
+
+def fetch_performance_window(minutes=5, db_path=metrics_db_path):
+    """Performance metric rows from the last `minutes` minutes, oldest first."""
+    return _query('performance_window', (f'-{minutes} minutes',), db_path)
+
+def fetch_performance_rollup_window(minutes=5, db_path=metrics_db_path):
+    """Per-second performance summary rows from the last `minutes` minutes, oldest first."""
+    return _query('performance_rollup_window', (f'-{minutes} minutes',), db_path)
+
+def insert_anomalies(anomaly_data, db_path=racing_db_path):
+    """Insert (timestamp, sensor, value, detection_time) rows into the anomalies table."""
+    conn = connect(db_path)
+    with conn:
+        conn.executemany("""
+            INSERT INTO anomalies (timestamp, sensor, value, detection_time)
+            VALUES (?, ?, ?, ?)
+        """, anomaly_data)
+
+def insert_performance_metrics(detection_time, response_time, threat_detection_rate, db_path=metrics_db_path):
+    """Insert one row into the performance_metrics table."""
+    conn = connect(db_path, 'metrics')
+    with conn:
+        conn.execute("""
+            INSERT INTO performance_metrics (detection_time, response_time, threat_detection_rate)
+            VALUES (?, ?, ?)
+        """, (detection_time, response_time, threat_detection_rate))
+
+def insert_performance_rollups(rows, db_path=metrics_db_path):
+    """Insert per-second summary rows into performance_rollup_1s in one transaction."""
+    conn = connect(db_path, 'metrics')
+    with conn:
+        conn.executemany("""
+            INSERT INTO performance_rollup_1s
+                (bucket_start, timestamp, tick_count, anomaly_count,
+                 detection_mean, detection_min, detection_max, detection_p50, detection_p90, detection_p99,
+                 response_mean, response_min, response_max, response_p50, response_p90, response_p99)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+def explain(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query."""
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+def plan_is_indexed(plan):
+    """A plan is acceptable when every table access goes through an index (or a primary key range) and nothing is sorted in a temp B-tree.
+
+    A bare 'SEARCH <table>' is SQLite's MIN()/MAX() optimisation, a single B-tree descent.
+    """
+    for detail in plan:
+        if 'TEMP B-TREE' in detail:
+            return False
+        if detail.startswith('SEARCH') and len(detail.split()) == 2:
+            continue
+        if detail.startswith('SCAN') and 'INDEX' not in detail:
+            return False
+        if detail.startswith('SEARCH') and 'INDEX' not in detail and 'PRIMARY KEY' not in detail:
+            return False
+    return True
+
+def verify_query_plans(racing_path=racing_db_path, metrics_path=metrics_db_path, wide_path=wide_db_path):
+    """EXPLAIN every query in QUERIES; returns {name: (ok, plan)} and logs any query that is not indexed."""
+    results = {}
+    paths = {'racing': racing_path, 'metrics': metrics_path, 'wide': wide_path}
+    for name, (kind, sql, params) in QUERIES.items():
+        try:
+            plan = explain(connect(paths[kind], kind), sql, params)
+        except sqlite3.Error as e:
+            plan = [f'error: {e}']
+        ok = plan_is_indexed(plan)
+        if not ok:
+            logging.warning(f"Query '{name}' is not served by an index: {plan}")
+        results[name] = (ok, plan)
+    return results
+
+if __name__ == "__main__":
+    # Apply the migrations and print the query plan of every query
+    for name, (ok, plan) in verify_query_plans().items():
+        print(f"{'OK  ' if ok else 'SCAN'} {name}: {'; '.join(plan)}")
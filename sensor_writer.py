@@ -0,0 +1,178 @@
+import queue
+import threading
+import time
+import logging
+import sensor_store
+import sensor_archive
+import db_pool
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+class SensorDataWriter:
+    """Write-behind writer that batches sensor_data inserts on a background thread."""
+
+    def __init__(self, db_path='racing_vehicle_db.sqlite', batch_size=5000, flush_interval=0.5,
+                 max_queue_size=10000, put_timeout=0.1, rollup=None, retention_interval=60.0, archive_age=None):
+        self.db_path = db_path
+        self.rollup = rollup  # Optional sensor_rollup.SensorRollup kept up to date with every batch
+        self.archive_age = archive_age  # Move rows older than this many seconds to sensor_archive; None keeps them
+        self.retention_interval = retention_interval
+        self.last_retention = time.monotonic()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        # Start the background writer thread
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='SensorDataWriter', daemon=True)
+        self.thread.start()
+        logging.info("Sensor data writer started.")
+
+    def stop(self):
+        # Stop the writer thread after flushing every queued row
+        if not self.running:
+            return
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        logging.info(f"Sensor data writer stopped ({self.rows_written} rows written, {self.rows_dropped} dropped).")
+
+    def write(self, timestamp, sensor, value):
+        """Queue a single (timestamp, sensor, value) row."""
+        self.write_many([(timestamp, sensor, value)])
+
+    def write_many(self, rows):
+        """Queue rows for insertion without touching the database on the caller's thread."""
+        # The queue holds whole chunks of rows, so max_queue_size bounds the number of pending chunks
+        rows = list(rows)
+        if not rows:
+            return
+        try:
+            self.queue.put(rows, timeout=self.put_timeout)
+        except queue.Full:
+            self.rows_dropped += len(rows)
+            logging.warning(f"Sensor data writer queue is full, dropping {len(rows)} rows.")
+
+    def _connect(self):
+        # The writer thread's pooled connection already runs in WAL mode with synchronous=NORMAL.
+        # A failed migration or backfill is logged; the writer keeps inserting rows either way
+        conn = db_pool.get_connection(self.db_path)
+        try:
+            sensor_store.migrate_schema(conn)
+        except Exception as e:
+            conn.rollback()
+            logging.error(f"Error migrating the sensor database schema: {e}")
+        if self.rollup is not None:
+            try:
+                self.rollup.ensure_backfilled(conn)
+            except Exception as e:
+                logging.error(f"Error backfilling sensor data rollups: {e}")
+        return conn
+
+    def _drain(self, batch, deadline):
+        # Collect rows until the batch is full or the time window closes
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.extend(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, conn, rows):
+        # Raw rows and their rollups commit together or not at all
+        try:
+            conn.executemany('''INSERT INTO sensor_data (timestamp, sensor, value)
+                                VALUES (?, ?, ?)''', rows)
+            if self.rollup is not None:
+                self.rollup.apply(conn, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _flush(self, conn, batch):
+        try:
+            self._write(conn, batch)
+            self.rows_written += len(batch)
+            return
+        except Exception as e:
+            logging.error(f"Error writing sensor data batch to database, retrying row by row: {e}")
+
+        # Salvage the good rows of a failed batch; the rows that still fail are dropped
+        for row in batch:
+            try:
+                self._write(conn, [row])
+                self.rows_written += 1
+            except Exception as e:
+                self.rows_dropped += 1
+                logging.error(f"Dropping sensor data row {row!r}: {e}")
+
+    def _apply_retention(self, conn):
+        self.last_retention = time.monotonic()
+        # Archive first; raw retention then waits until rows are old enough to have been archived
+        if self.archive_age is not None:
+            try:
+                sensor_archive.archive_aged(self.archive_age, self.db_path)
+            except Exception as e:
+                logging.error(f"Error archiving aged sensor data: {e}")
+        if self.rollup is None:
+            return
+        # Days are archived whole once they are entirely older than archive_age, i.e. up to a day later
+        min_raw_age = self.archive_age + 24 * 3600 if self.archive_age is not None else None
+        try:
+            deleted = self.rollup.apply_retention(conn, min_raw_age=min_raw_age)
+            if any(deleted.values()):
+                logging.info(f"Sensor data retention deleted {deleted}.")
+        except Exception as e:
+            logging.error(f"Error applying sensor data retention: {e}")
+
+    def _run(self):
+        # Keep trying to open the database; queued rows wait for it rather than being lost with the thread
+        conn = None
+        while conn is None:
+            try:
+                conn = self._connect()
+            except Exception as e:
+                logging.error(f"Error connecting sensor data writer to {self.db_path}: {e}")
+                if not self.running:
+                    while True:
+                        try:
+                            self.rows_dropped += len(self.queue.get_nowait())
+                        except queue.Empty:
+                            return
+                time.sleep(self.flush_interval)
+        try:
+            while self.running:
+                batch = self._drain([], time.monotonic() + self.flush_interval)
+                if batch:
+                    self._flush(conn, batch)
+                if ((self.rollup is not None or self.archive_age is not None)
+                        and time.monotonic() - self.last_retention >= self.retention_interval):
+                    self._apply_retention(conn)
+
+            # Flush whatever is still queued on shutdown
+            batch = []
+            while True:
+                try:
+                    batch.extend(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+                if len(batch) >= self.batch_size:
+                    self._flush(conn, batch)
+                    batch = []
+            if batch:
+                self._flush(conn, batch)
+        finally:
+            db_pool.close_connection(self.db_path)
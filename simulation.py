@@ -1,169 +1,274 @@
-import random
+import argparse
+import json
 import numpy as np
-import sqlite3
 import time
-from sklearn.impute import SimpleImputer
-from sklearn.linear_model import LogisticRegression
-from anomaly_detection import detect_anomalies
+from anomaly_detection import detect_anomalies_batch, detector_engines, set_detector_engine
 from communication_module import CANSimulation
-from penetrating_scenarios import scenario_increase_values, scenario_sensor_failure, scenario_noise_injection
-from adaptive_mechanisms import adaptive_responses, DRLAgent
+from adaptive_mechanisms import adaptive_responses, get_policy
+from numpy_policy import policy_weights_path
 from performance_metrics import PerformanceMetrics
+from sensor_writer import SensorDataWriter
+from sensor_rollup import SensorRollup
+import vehicle_model
+from vehicle_model import sensors, num_sensors, ThreatPredictor
+from stage_timing import StageTimer, null_timer
+from model_refitter import BackgroundRefitter
+from policy_learner import BackgroundLearner
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
-# Connect to SQLite database
-conn = sqlite3.connect('racing_vehicle_db.sqlite')
-cursor = conn.cursor()
+# Write-behind writer for the SQLite database; inserts are batched on a background thread and
+# folded into the 1s/10s/1min rollup tables in the same transaction
+sensor_writer = SensorDataWriter('racing_vehicle_db.sqlite', rollup=SensorRollup())
+sensor_writer.start()
 
-# Simulated sensor data variables
-sensors = ['Temperature', 'Speed', 'Engine Sensors', 'Brakes', 'Fluid Level', 'Heat', 'Tire Pressure', 'Battery']
-num_sensors = len(sensors)
+# Number of vehicles simulated per tick and the seeded generator used for batched simulation
+n_vehicles = 1
+rng = np.random.default_rng(42)
 
-# Initialize lists and dictionaries for sensor data, behavioral data, and adaptive response
-sensor_data = {sensor: [] for sensor in sensors}
-behavioral_data = {sensor: [0] for sensor in sensors}
-adaptive_actions = {sensor: None for sensor in sensors}
+# Window sizes (in rows) for the rolling sensor statistics and the behavioral feature history
+sensor_window = 10000
+behavioral_window = 1000
+
+# Rolling behavioral features and the threat-prediction logistic regression, fitted on the first tick
+threat_predictor = ThreatPredictor(sensor_window, behavioral_window)
 
-# Logistic Regression model for predictive analytics
-model_lr = LogisticRegression(random_state=42)
+# Adaptive response selected for each sensor
+adaptive_actions = {sensor: None for sensor in sensors}
 
-# Deep Reinforcement Learning agent
+# Deep Reinforcement Learning policy, evaluated with NumPy
 state_dim = num_sensors
 action_dim = len(adaptive_responses)
-agent = DRLAgent(state_dim, action_dim)
+agent = get_policy(state_dim, action_dim)
+
+# Optional background learner fed with one transition per tick, and the pending (state, action, reward)
+learner = None
+pending_transition = None
 
 # Initialize Performance Metrics
 performance_metrics = PerformanceMetrics()
 
-def simulate_sensor_values():
-    sensor_values = [random.uniform(20, 100) for _ in range(num_sensors)]
-    
-    # Sequentially apply penetration scenarios
-    sensor_values = scenario_increase_values(sensor_values)
-    sensor_values = scenario_sensor_failure(sensor_values)
-    sensor_values = scenario_noise_injection(sensor_values)
-    
-    return sensor_values
+def simulate_sensor_batch(n_vehicles, generator=None):
+    """Simulate one tick for a fleet of vehicles as an (n_vehicles, num_sensors) array."""
+    return vehicle_model.simulate_sensor_batch(n_vehicles, rng if generator is None else generator)
 
-def restore_sensor_values(sensor_values):
-    """Restore sensor values to normal after adaptive actions."""
-    for i in range(len(sensor_values)):
-        if sensor_values[i] < 20 or sensor_values[i] > 100:
-            sensor_values[i] = random.uniform(20, 100)
+def restore_sensor_batch(sensor_values, generator=None):
+    """Restore out-of-range sensor values to normal after adaptive actions, for an (n_vehicles, num_sensors) array."""
+    generator = rng if generator is None else generator
+    out_of_range = (sensor_values < 20) | (sensor_values > 100)
+    sensor_values[out_of_range] = generator.uniform(20, 100, size=int(out_of_range.sum()))
     return sensor_values
 
-def simulate_and_analyze(can_sim):
-    start_time = time.time()
-    
-    sensor_values = simulate_sensor_values()
-    
-    # Detect anomalies using the imported function from anomaly_detection.py
-    anomaly_flags, anomaly_values = detect_anomalies(sensor_values)
-    
-    # Perform behavioral analysis (example: use mean feature extraction)
-    mean_features = {sensor: np.mean(sensor_data[sensor]) if sensor_data[sensor] else 0 for sensor in sensors}
-    for sensor in sensors:
-        behavioral_data[sensor].append(mean_features[sensor])
-    
-    # Preprocess data to handle NaN values before training the model
-    X_train = np.array(list(behavioral_data.values())).T
-    imputer = SimpleImputer(strategy='mean')  # Example: impute NaNs with mean of the column
-    X_train = imputer.fit_transform(X_train)
-    
-    # Check if X_train has valid features for fitting
-    if X_train.shape[1] == 0:
-        raise ValueError("No valid features available for training.")
-    
-    # Train logistic regression model if not already fitted
-    if not hasattr(model_lr, 'classes_'):
-        # Mock training labels with at least two classes
-        y_train = np.array([0, 1] * (X_train.shape[0] // 2))
-        model_lr.fit(X_train, y_train[:X_train.shape[0]])  # Fit the model with mock data
-    
-    # Perform predictive analytics (example: logistic regression for threat prediction)
-    feature_set = np.array([mean_features[sensor] for sensor in sensors]).reshape(1, -1)
-    feature_set = imputer.transform(feature_set)  # Ensure feature_set is also imputed
-    threat_probability = model_lr.predict_proba(feature_set)[:, 1]
-    
+def detect_stage(sensor_batch):
+    """Detect anomalies for every vehicle; a sensor is flagged for the tick if it is anomalous on any vehicle."""
+    vehicle_flags, _ = detect_anomalies_batch(sensor_batch)
+    anomaly_flags = dict(zip(sensors, vehicle_flags.any(axis=0).tolist()))
+    return vehicle_flags, anomaly_flags
+
+def predict_stage(sensor_batch):
+    """Behavioral feature extraction and threat prediction; returns (mean_vector, threat_probability)."""
+    return threat_predictor.predict(sensor_batch)
+
+def respond_stage(mean_vector, anomaly_flags):
+    """Select the DRL action and the adaptive responses; returns (action, response_time)."""
     # Adaptive response mechanism based on anomaly detection
-    state = np.array([mean_features[sensor] for sensor in sensors])
-    action, response_time = agent.select_action(state)
+    global pending_transition
+    action, response_time = agent.select_action(mean_vector)
     
-    for i, sensor in enumerate(sensors):
+    for sensor in sensors:
         if anomaly_flags[sensor]:
             adaptive_actions[sensor] = adaptive_responses[sensor]  # Use adaptive response functions
     
-    # Insert sensor values into the SQLite database with their respective names
+    # Hand the previous tick's transition to the learner; the action is rewarded when it targets a flagged sensor
+    if learner is not None:
+        if pending_transition is not None:
+            learner.submit(*pending_transition, mean_vector)
+        reward = 1.0 if anomaly_flags[sensors[action]] else 0.0
+        pending_transition = (mean_vector, action, reward)
+    
+    return action, response_time
+
+def persist_stage(sensor_batch):
+    """Queue the sensor values of every vehicle for the SQLite database with their respective names."""
     try:
         timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
-        for i, sensor in enumerate(sensors):
-            cursor.execute('''INSERT INTO sensor_data (timestamp, sensor, value)
-                              VALUES (?, ?, ?)''', (timestamp, sensor, sensor_values[i]))
-        conn.commit()
+        rows = [(timestamp, sensor, float(value))
+                for vehicle_values in sensor_batch
+                for sensor, value in zip(sensors, vehicle_values)]
+        sensor_writer.write_many(rows)
     except Exception as e:
         logging.error(f"Error inserting sensor values into database: {e}")
-    
-    # Record sensor data in memory for behavioral analysis
-    for i, sensor in enumerate(sensors):
-        sensor_data[sensor].append(sensor_values[i])
-    
-    # Publish data to CAN bus
+
+def publish_stage(can_sim, sensor_batch, vehicle_flags):
+    """Publish data to CAN bus, one pair of frames per vehicle."""
     try:
-        can_sim.publish_data(can_id=0x200, data=[int(value) for value in sensor_values])
-        can_sim.publish_data(can_id=0x100, data=[int(anomaly_flags[sensor]) for sensor in sensors])
+        for vehicle_values, flags in zip(sensor_batch, vehicle_flags):
+            can_sim.publish_data(can_id=0x200, data=[int(value) for value in vehicle_values])
+            can_sim.publish_data(can_id=0x100, data=[int(flag) for flag in flags])
     except Exception as e:
         logging.error(f"Error publishing data to CAN bus: {e}")
+
+def simulate_and_analyze(can_sim, n_vehicles=1, stage_timer=None):
+    timer = stage_timer or null_timer
+    start_time = time.time()
+    
+    with timer.stage('simulate'):
+        sensor_batch = simulate_sensor_batch(n_vehicles)
+    
+    # Detect anomalies using the imported function from anomaly_detection.py
+    with timer.stage('detect'):
+        vehicle_flags, anomaly_flags = detect_stage(sensor_batch)
+    
+    with timer.stage('predict'):
+        mean_vector, threat_probability = predict_stage(sensor_batch)
+    mean_features = dict(zip(sensors, mean_vector.tolist()))
+    
+    with timer.stage('drl_action'):
+        action, response_time = respond_stage(mean_vector, anomaly_flags)
+    
+    with timer.stage('db_insert'):
+        persist_stage(sensor_batch)
+    
+    with timer.stage('can_publish'):
+        publish_stage(can_sim, sensor_batch, vehicle_flags)
     
     # Restore sensor values to normal after adaptive actions
-    sensor_values = restore_sensor_values(sensor_values)
+    sensor_batch = restore_sensor_batch(sensor_batch)
     
     # Record performance metrics
     end_time = time.time()
     detection_time = end_time - start_time
     performance_metrics.update_detection_metrics([detection_time, response_time, 1.0 if any(anomaly_flags.values()) else 0.0])
     
-    return sensor_values, mean_features, threat_probability, adaptive_actions
+    return sensor_batch, mean_features, threat_probability, adaptive_actions
 
-# Main loop to run the simulation
-if __name__ == "__main__":
+def run_headless(ticks=1000, seed=42, n_vehicles=1, json_path=None):
+    """Run a fixed number of ticks without sleeping or printing and report throughput and stage latencies."""
+    global rng
+    
+    # Fix the seed of the generator the simulation draws from
+    rng = np.random.default_rng(seed)
+    
+    # Silence per-tick logging so the measurement covers the pipeline, not the console
+    logging.getLogger().setLevel(logging.WARNING)
+    
     can_sim = CANSimulation()
     can_sim.start()
+    stage_timer = StageTimer()
     
     try:
-        while True:
-            sensor_values, mean_features, threat_prob, actions = simulate_and_analyze(can_sim)
-            
-            # Print simulated sensor values
-            print("\n--- Simulated Sensor Values ---")
-            for sensor, value in zip(sensors, sensor_values):
-                print(f"{sensor}: {value:.2f}")
-            
-            # Print behavioral analysis
-            print("\n--- Behavioral Analysis - Mean Features ---")
-            for sensor, mean_value in mean_features.items():
-                print(f"{sensor}: {mean_value:.2f}")
-            
-            # Print predictive analytics
-            print(f"\n--- Predictive Analytics ---")
-            print(f"Threat Probability: {threat_prob[0]:.4f}")
-            
-            # Print adaptive actions
-            print("\n--- Adaptive Actions ---")
-            for sensor, action in actions.items():
-                if action:
-                    print(f"{sensor}: {action}")
-                else:
-                    print(f"{sensor}: No adaptive action required.")
-            
-            # Wait before the next simulation iteration
-            time.sleep(1)
-    
-    except KeyboardInterrupt:
-        print("Simulation interrupted.")
-    
+        start = time.perf_counter()
+        for _ in range(ticks):
+            with stage_timer.stage('tick'):
+                simulate_and_analyze(can_sim, n_vehicles, stage_timer)
+        elapsed = time.perf_counter() - start
     finally:
         can_sim.stop()
-        conn.close()
+        sensor_writer.stop()
+        performance_metrics.rollup.stop()
+    
+    results = {
+        'ticks': ticks,
+        'n_vehicles': n_vehicles,
+        'seed': seed,
+        'elapsed_s': elapsed,
+        'ticks_per_sec': ticks / elapsed if elapsed > 0 else float('inf'),
+        'vehicle_ticks_per_sec': ticks * n_vehicles / elapsed if elapsed > 0 else float('inf'),
+        'stages': stage_timer.summary(),
+    }
+    
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+    
+    return results
+
+# Main loop to run the simulation
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Racing vehicle sensor simulation")
+    parser.add_argument('--vehicles', type=int, default=n_vehicles, help="Number of vehicles simulated per tick")
+    parser.add_argument('--detector', choices=sorted(detector_engines), default='isolation_forest', help="Anomaly detection engine")
+    parser.add_argument('--scoring-backend', choices=['sklearn', 'flat'], default='sklearn',
+                        help="IsolationForest scoring backend: sklearn estimators or flattened NumPy arrays")
+    parser.add_argument('--refit', action='store_true', help="Refit drifted anomaly models on a background thread")
+    parser.add_argument('--archive-days', type=float, help="Move sensor_data rows older than this many days to sensor_archive")
+    parser.add_argument('--learn', action='store_true', help="Train the DRL policy online on a background learner thread")
+    parser.add_argument('--headless', action='store_true', help="Run a fixed number of ticks as fast as possible and report throughput")
+    parser.add_argument('--ticks', type=int, default=1000, help="Number of ticks to run in headless mode")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed for headless mode")
+    parser.add_argument('--json', dest='json_path', help="Write the headless benchmark results to this JSON file")
+    args = parser.parse_args()
+    if args.detector == 'isolation_forest':
+        set_detector_engine(args.detector, backend=args.scoring_backend)
+    else:
+        set_detector_engine(args.detector)
+    
+    # Refit drifted anomaly models in the background instead of inline in detection
+    if args.refit:
+        BackgroundRefitter().start()
+    
+    # Periodically move aged rows out of sensor_data into the memory-mapped archive
+    if args.archive_days is not None:
+        sensor_writer.archive_age = args.archive_days * 24 * 3600
+    
+    # Train the DRL policy in the background and publish new weights to the acting agent
+    if args.learn:
+        learner = BackgroundLearner(agent)
+        learner.start()
+    
+    if args.headless:
+        results = run_headless(args.ticks, args.seed, args.vehicles, args.json_path)
+        
+        # Print the benchmark report
+        print(f"{results['ticks']} ticks x {results['n_vehicles']} vehicles in {results['elapsed_s']:.2f} s "
+              f"({results['ticks_per_sec']:.1f} ticks/sec)")
+        for stage, stats in results['stages'].items():
+            print(f"{stage:12s} p50={stats['p50_ms']:.3f} ms  p95={stats['p95_ms']:.3f} ms  p99={stats['p99_ms']:.3f} ms")
+    
+    else:
+        can_sim = CANSimulation()
+        can_sim.start()
+        
+        try:
+            while True:
+                sensor_batch, mean_features, threat_prob, actions = simulate_and_analyze(can_sim, args.vehicles)
+                
+                # Print simulated sensor values of the first vehicle
+                print(f"\n--- Simulated Sensor Values (vehicle 1 of {len(sensor_batch)}) ---")
+                for sensor, value in zip(sensors, sensor_batch[0]):
+                    print(f"{sensor}: {value:.2f}")
+                
+                # Print behavioral analysis
+                print("\n--- Behavioral Analysis - Mean Features ---")
+                for sensor, mean_value in mean_features.items():
+                    print(f"{sensor}: {mean_value:.2f}")
+                
+                # Print predictive analytics
+                print(f"\n--- Predictive Analytics ---")
+                print(f"Threat Probability: {threat_prob[0]:.4f}")
+                
+                # Print adaptive actions
+                print("\n--- Adaptive Actions ---")
+                for sensor, action in actions.items():
+                    if action:
+                        print(f"{sensor}: {action}")
+                    else:
+                        print(f"{sensor}: No adaptive action required.")
+                
+                # Wait before the next simulation iteration
+                time.sleep(1)
+        
+        except KeyboardInterrupt:
+            print("Simulation interrupted.")
+        
+        finally:
+            can_sim.stop()
+            sensor_writer.stop()
+            performance_metrics.rollup.stop()
+    
+    # Stop the learner and keep the trained policy for the next run
+    if learner is not None:
+        learner.stop()
+        agent.save(policy_weights_path)
@@ -0,0 +1,43 @@
+import time
+from contextlib import contextmanager
+import numpy as np
+
+class StageTimer:
+    """Collects wall-clock durations per pipeline stage and reports latency percentiles."""
+
+    def __init__(self):
+        self.durations = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        self.durations.setdefault(name, []).append(seconds)
+
+    def summary(self, percentiles=(50, 95, 99)):
+        """Return {stage: {'count', 'mean_ms', 'p50_ms', ...}} for every recorded stage."""
+        report = {}
+        for name, values in self.durations.items():
+            values_ms = np.asarray(values) * 1000.0
+            stats = {'count': int(values_ms.size), 'mean_ms': float(values_ms.mean())}
+            for p, value in zip(percentiles, np.percentile(values_ms, percentiles)):
+                stats[f'p{p}_ms'] = float(value)
+            report[name] = stats
+        return report
+
+class NullStageTimer:
+    """Stand-in for StageTimer when no timings are being collected."""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def record(self, name, seconds):
+        pass
+
+null_timer = NullStageTimer()
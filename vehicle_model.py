@@ -0,0 +1,76 @@
+import numpy as np
+from penetrating_scenarios import scenario_increase_values_batch, scenario_sensor_failure_batch, scenario_noise_injection_batch
+from behavioral_features import RollingSensorStats, RunningMeanImputer
+
+# Simulation and threat prediction shared by simulation.py and the fleet_sharding workers. Importing
+# this module has no side effects (no database writers, threads or policies), so spawned workers can
+# use it without dragging in simulation.py's globals.
+
+# Simulated sensor data variables
+sensors = ['Temperature', 'Speed', 'Engine Sensors', 'Brakes', 'Fluid Level', 'Heat', 'Tire Pressure', 'Battery']
+num_sensors = len(sensors)
+
+def simulate_sensor_batch(n_vehicles, generator):
+    """Simulate one tick for a fleet of vehicles as an (n_vehicles, num_sensors) array."""
+    sensor_values = generator.uniform(20, 100, size=(n_vehicles, num_sensors))
+
+    # Apply the penetration scenarios to the whole fleet at once
+    sensor_values = scenario_increase_values_batch(sensor_values, generator)
+    sensor_values = scenario_sensor_failure_batch(sensor_values, generator)
+    sensor_values = scenario_noise_injection_batch(sensor_values, generator)
+
+    return sensor_values
+
+class ThreatPredictor:
+    """Behavioral features and the threat-prediction logistic regression for one stream of ticks."""
+
+    def __init__(self, sensor_window=10000, behavioral_window=1000):
+        # Rolling statistics for sensor data and behavioral data
+        self.sensor_data = RollingSensorStats(num_sensors, window=sensor_window)
+        self.behavioral_data = RollingSensorStats(num_sensors, window=behavioral_window)
+        self.behavioral_data.update(np.zeros(num_sensors))
+
+        # Incremental mean imputer for the behavioral features, updated with one row per tick
+        self.imputer = RunningMeanImputer(num_sensors)
+        self.imputer.partial_fit(np.zeros(num_sensors))
+
+        # Logistic Regression model, created and fitted on the first tick
+        self.model_lr = None
+
+    def fit(self):
+        # sklearn is only imported here
+        from sklearn.linear_model import LogisticRegression
+
+        # Preprocess data to handle NaN values before training the model
+        X_train = self.imputer.transform(self.behavioral_data.values())
+
+        # Check if X_train has valid features for fitting
+        if X_train.shape[1] == 0:
+            raise ValueError("No valid features available for training.")
+
+        # Mock training labels with at least two classes
+        y_train = np.array([0, 1] * (X_train.shape[0] // 2))
+        self.model_lr = LogisticRegression(random_state=42)
+        self.model_lr.fit(X_train, y_train[:X_train.shape[0]])  # Fit the model with mock data
+
+    def predict(self, sensor_batch):
+        """Behavioral feature extraction and threat prediction; returns (mean_vector, threat_probability)."""
+        # Perform behavioral analysis (example: use mean feature extraction)
+        mean_vector = self.sensor_data.mean()
+        self.behavioral_data.update(mean_vector)
+
+        # Fold the new feature row into the running column means used to impute NaN values
+        self.imputer.partial_fit(mean_vector)
+
+        # Train logistic regression model if not already fitted
+        if self.model_lr is None:
+            self.fit()
+
+        # Perform predictive analytics (example: logistic regression for threat prediction)
+        feature_set = self.imputer.transform(mean_vector)  # Ensure feature_set is also imputed
+        threat_probability = self.model_lr.predict_proba(feature_set)[:, 1]
+
+        # Record sensor data in the rolling window for behavioral analysis
+        self.sensor_data.update(sensor_batch)
+
+        return mean_vector, threat_probability
@@ -0,0 +1,272 @@
+import argparse
+import os
+import time
+import logging
+import numpy as np
+import sensor_store
+from sensor_store import wide_db_path
+from sensor_rollup import to_epoch, to_timestamp
+
+# Configure logging
+logging.basicConfig(level=logging.DEBUG)
+
+# Readings are packed as little-endian float32, one slot per sensor id; missing readings are NaN
+READING_DTYPE = np.dtype('<f4')
+
+def connect(db_path=wide_db_path):
+    return sensor_store.connect(db_path, 'wide')
+
+def sensor_names(conn):
+    """Sensor names in id (slot) order."""
+    return [name for _, name in conn.execute('SELECT id, name FROM sensors ORDER BY id')]
+
+def sensor_ids(conn, names):
+    """Slot of every name, adding missing sensors to the dictionary; the caller commits."""
+    known = {name: i for i, name in enumerate(sensor_names(conn))}
+    for name in names:
+        if name not in known:
+            known[name] = len(known)
+            conn.execute('INSERT INTO sensors (id, name) VALUES (?, ?)', (known[name], name))
+    return [known[name] for name in names]
+
+def unpack(blob, width):
+    """Readings of one tick padded with NaN to `width` slots (ticks written before a sensor was added are shorter)."""
+    readings = np.frombuffer(blob, dtype=READING_DTYPE)
+    if len(readings) < width:
+        readings = np.concatenate([readings, np.full(width - len(readings), np.nan, dtype=READING_DTYPE)])
+    return readings
+
+def to_ns(timestamp):
+    """Integer nanosecond epoch of a sensor_data timestamp (local time string or epoch seconds)."""
+    if isinstance(timestamp, float):
+        return int(round(timestamp * 1e9))
+    return to_epoch(timestamp) * 10 ** 9
+
+def insert_ticks(timestamps_ns, readings, names, db_path=wide_db_path):
+    """Insert one row per tick: `readings` is (ticks, len(names)) in `names` column order."""
+    conn = connect(db_path)
+    with conn:
+        slots = sensor_ids(conn, names)
+        width = max(slots) + 1
+        packed = np.full((len(timestamps_ns), width), np.nan, dtype=READING_DTYPE)
+        packed[:, slots] = readings
+        conn.executemany('INSERT INTO sensor_ticks (ts_ns, readings) VALUES (?, ?)',
+                         [(int(ts), row.tobytes()) for ts, row in zip(timestamps_ns, packed)])
+
+class TickPacker:
+    """Groups (timestamp, sensor, value) rows, in insertion order, into packed one-row-per-tick records.
+
+    A new tick starts when a sensor repeats or a reading is at least `tick_gap` seconds after the
+    tick's first one (older databases stamped every row separately). Ticks keep their insertion
+    order and get unique keys: a tick whose timestamp is missing, or not after the previous tick's,
+    is keyed 1 ns after the previous one.
+    """
+
+    def __init__(self, conn, tick_gap=1.0):
+        self.conn = conn
+        self.tick_gap_ns = int(tick_gap * 1e9)
+        self.slots = {name: i for i, name in enumerate(sensor_names(conn))}
+        self.last_ns = conn.execute('SELECT MAX(ts_ns) FROM sensor_ticks').fetchone()[0] or 0
+        self.tick_ns = None  # Epoch of the open tick's first timestamped reading
+        self.readings = {}
+        self._ns = {}  # timestamp -> ns; consecutive rows share a few distinct timestamps
+
+    def _slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = sensor_ids(self.conn, [name])[0]
+        return slot
+
+    def _to_ns(self, timestamp):
+        ts_ns = self._ns.get(timestamp)
+        if ts_ns is None:
+            if len(self._ns) > 4096:
+                self._ns.clear()
+            ts_ns = self._ns[timestamp] = to_ns(timestamp)
+        return ts_ns
+
+    def _emit(self, ticks):
+        if not self.readings:
+            return
+        self.last_ns = max(self.tick_ns or 0, self.last_ns + 1)
+        readings = np.full(len(self.slots), np.nan, dtype=READING_DTYPE)
+        for slot, value in self.readings.items():
+            readings[slot] = value
+        ticks.append((self.last_ns, readings.tobytes()))
+        self.tick_ns = None
+        self.readings = {}
+
+    def add(self, rows):
+        """Fold rows in and return the (ts_ns, readings) records of the ticks they completed."""
+        ticks = []
+        for timestamp, sensor, value in rows:
+            if sensor is None:
+                continue
+            slot = self._slot(sensor)
+            ts_ns = self._to_ns(timestamp) if timestamp is not None else None
+            if slot in self.readings or (ts_ns is not None and self.tick_ns is not None
+                                         and abs(ts_ns - self.tick_ns) >= self.tick_gap_ns):
+                self._emit(ticks)
+            if self.tick_ns is None:
+                self.tick_ns = ts_ns
+            self.readings[slot] = np.nan if value is None else value
+        return ticks
+
+    def flush(self):
+        """Records of the last, still open tick."""
+        ticks = []
+        self._emit(ticks)
+        return ticks
+
+def migrate(src=sensor_store.racing_db_path, dst=wide_db_path, page_size=50000):
+    """Copy sensor_data from `src` into the compact schema in `dst`; returns the number of ticks written."""
+    source = sensor_store.connect(src)
+    conn = connect(dst)
+    if conn.execute('SELECT 1 FROM sensor_ticks LIMIT 1').fetchone():
+        raise ValueError(f"{dst} already holds sensor ticks; remove it before migrating again")
+
+    packer = TickPacker(conn)
+    cursor = source.execute('SELECT timestamp, sensor, value FROM sensor_data ORDER BY rowid')
+    written = 0
+    with conn:
+        while True:
+            rows = cursor.fetchmany(page_size)
+            ticks = packer.add(rows) if rows else packer.flush()
+            conn.executemany('INSERT INTO sensor_ticks (ts_ns, readings) VALUES (?, ?)', ticks)
+            written += len(ticks)
+            if not rows:
+                break
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # Move the pages out of the WAL so the file size is final
+    return written
+
+def fetch_tick_arrays(start_ns=0, end_ns=2 ** 63 - 1, db_path=wide_db_path):
+    """(ts_ns int64 array, readings float32 (ticks, sensors) array, sensor names) for start_ns <= ts_ns < end_ns."""
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    _, sql, _ = sensor_store.QUERIES['wide_tick_range']
+    rows = conn.execute(sql, (start_ns, end_ns)).fetchall()
+    timestamps = np.fromiter((ts for ts, _ in rows), dtype=np.int64, count=len(rows))
+    width = len(names) * READING_DTYPE.itemsize
+    if all(len(blob) == width for _, blob in rows):
+        readings = np.frombuffer(b''.join(blob for _, blob in rows), dtype=READING_DTYPE).reshape(len(rows), len(names))
+    else:
+        readings = np.stack([unpack(blob, len(names)) for _, blob in rows]) if rows else np.empty((0, len(names)), READING_DTYPE)
+    return timestamps, readings, names
+
+# Read adapters: same signatures and row shapes as the sensor_store functions of the same name.
+# Timestamps come back in the sensor_data text format; ticks without a reading for a sensor (NaN)
+# produce no row for it.
+
+def _readings(blob, width):
+    return [None if value != value else value for value in unpack(blob, width).tolist()]
+
+def _expand(ticks, names):
+    # (ts_ns, timestamp text, sensor, value) per reading, in the order the ticks are given
+    for ts_ns, blob in ticks:
+        timestamp = to_timestamp(ts_ns // 10 ** 9)
+        for name, value in zip(names, _readings(blob, len(names))):
+            if value is not None:
+                yield ts_ns, timestamp, name, value
+
+def _ticks_newest_first(conn, page_size):
+    _, sql, _ = sensor_store.QUERIES['wide_ticks_before']
+    before = 2 ** 63 - 1
+    while True:
+        ticks = conn.execute(sql, (before, page_size)).fetchall()
+        yield from ticks
+        if len(ticks) < page_size:
+            return
+        before = ticks[-1][0]
+
+def fetch_latest_rows(limit=8, db_path=wide_db_path):
+    """Latest `limit` (sensor, value) readings, newest first; the last sensor of a tick counts as its newest."""
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    rows = []
+    for _, blob in _ticks_newest_first(conn, max(1, -(-limit // max(len(names), 1)))):
+        for name, value in reversed(list(zip(names, _readings(blob, len(names))))):
+            if value is not None:
+                rows.append((name, value))
+                if len(rows) >= limit:
+                    return rows
+    return rows
+
+def fetch_recent_values(limit=1000, db_path=wide_db_path):
+    """Latest `limit` values across all sensors, newest first."""
+    return [value for _, value in fetch_latest_rows(limit, db_path)]
+
+def fetch_sensor_history(sensor, limit=1000, db_path=wide_db_path):
+    """Latest `limit` values of one sensor, newest first."""
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    if sensor not in names:
+        return []
+    slot, width = names.index(sensor), len(names)
+    values = []
+    for _, blob in _ticks_newest_first(conn, limit):
+        value = _readings(blob, width)[slot]
+        if value is not None:
+            values.append(value)
+            if len(values) >= limit:
+                break
+    return values
+
+def iter_sensor_data_with_timestamps(page_size=10000, db_path=wide_db_path):
+    """Yield every (sensor, value, timestamp) reading in time order, reading `page_size` ticks at a time."""
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    _, sql, _ = sensor_store.QUERIES['wide_ticks_since']
+    after = -1
+    while True:
+        ticks = conn.execute(sql, (after, page_size)).fetchall()
+        for _, timestamp, name, value in _expand(ticks, names):
+            yield name, value, timestamp
+        if len(ticks) < page_size:
+            return
+        after = ticks[-1][0]
+
+def fetch_sensor_rows_since(rowid, limit=10000, db_path=wide_db_path):
+    """Readings of the ticks after `rowid` as (ts_ns, sensor, value, timestamp), oldest first.
+
+    ts_ns plays the part of the sensor_data rowid: it is the high-water mark to pass back in.
+    Whole ticks are returned, about `limit` readings' worth.
+    """
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    ticks = sensor_store._query('wide_ticks_since', (rowid, max(1, -(-limit // max(len(names), 1)))), db_path)
+    return [(ts_ns, name, value, timestamp) for ts_ns, timestamp, name, value in _expand(ticks, names)]
+
+def fetch_sensor_range(start, end, db_path=wide_db_path):
+    """(timestamp, sensor, value) readings with start <= timestamp < end (timestamp strings), oldest first."""
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    ticks = sensor_store._query('wide_tick_range', (to_ns(start), to_ns(end)), db_path)
+    return [(timestamp, name, value) for _, timestamp, name, value in _expand(ticks, names)]
+
+def fetch_sensor_window(minutes=5, db_path=wide_db_path):
+    """(timestamp, sensor, value) readings from the last `minutes` minutes, oldest first."""
+    conn = connect(db_path)
+    names = sensor_names(conn)
+    start_ns = int((time.time() - minutes * 60) * 1e9)
+    ticks = sensor_store._query('wide_tick_range', (start_ns, 2 ** 63 - 1), db_path)
+    return [(timestamp, name, value) for _, timestamp, name, value in _expand(ticks, names)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate sensor_data into the compact one-row-per-tick schema")
+    parser.add_argument('--src', default=sensor_store.racing_db_path, help="Racing database to read sensor_data from")
+    parser.add_argument('--dst', default=wide_db_path, help="Compact database to create")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ticks = migrate(args.src, args.dst)
+    print(f"Migrated {ticks} ticks in {time.perf_counter() - start:.2f} s")
+
+    # Compare file sizes and full scans of both layouts
+    start = time.perf_counter()
+    rows = sum(1 for _ in sensor_store.iter_sensor_data_with_timestamps(db_path=args.src))
+    long_scan = time.perf_counter() - start
+    start = time.perf_counter()
+    timestamps, readings, names = fetch_tick_arrays(db_path=args.dst)
+    wide_scan = time.perf_counter() - start
+    print(f"sensor_data:  {os.path.getsize(args.src) / 1e6:.2f} MB, {rows} rows scanned in {long_scan * 1e3:.1f} ms")
+    print(f"sensor_ticks: {os.path.getsize(args.dst) / 1e6:.2f} MB, {readings.size} readings scanned in {wide_scan * 1e3:.1f} ms")